@@ -1,54 +1,73 @@
-from numpy.testing._private.utils import IgnoreException
-import pyaudio
-import wave
 import numpy as np
 import struct
-import matplotlib.pyplot as plt
 import time
+import os
+import sys
 from math import log
 from threading import Thread
 
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("/".join(path.split('/')[:-2]))
+
+from src.metrics import METRICS
+from src.SONAR.backends import PyAudioBackend
+from src.SONAR.calibration import cache_key, load_calibration, save_calibration
+from src.SONAR.movement import MotionEvent, MovementState
+from src.SONAR.ring_buffer import RingBuffer
+from src.SONAR.spectral import make_spectral_engine, noise_bandwidth
+from src.SONAR.tones import burst, tone
+from src.SONAR.wavio import WavRecorder, open_wav, to_float32
+
 SAMPLE_RATE = 44100  # default audio sample rate
 # dimensions of the threshold array to feed into visual ML
-WIDTH = 300
+WIDTH = 300  # spectra kept by the rolling spectrogram
 HEIGHT = 300
 BUFFER_SIZE = 2048
 SOUND_SPEED = 343
-THRESH_PROP = 1/38
-THRESH = 1  # FFT threshold to filter out noise, will be THRESH_PROP * base amplitude
+THRESH_PROP = 1/38  # noise threshold relative to the carrier amplitude, for the rect window
+THRESH = 1  # initial FFT threshold to filter out noise, calibration sets it to THRESH_PROP * base amplitude
 STALL_WINDOW_THRESH = 1  # number of stalled windows allowed within a single movement
 ENABLE_DRAW = False  # whether to plot data
 
 CALIBRATION_WINDOWS = 50  # number of windows to use for calibration
 MIN_ALLOWED_AMP = 10  # minimum volume threshold to account for noise floor
 MOV_AVG_ALPH = 0.2  # weighting factor for calibration average
+VERIFY_WINDOWS = 10  # windows measured to confirm a cached calibration
+VERIFY_TOLERANCE = 1.5  # a cached amplitude is kept if within this factor of the measured one
+ADAPT_ALPH = 0.01  # per window weighting of the carrier amplitude tracked while not moving
+RING_WINDOWS = 8  # capacity of the input ring buffer, in windows
+READ_TIMEOUT = 0.1  # seconds to block waiting for input before rechecking terminate
+SPECTRAL_ENGINE = None  # 'rfft', 'dft' or 'sliding' to force a spectral engine, None picks one by band width
+HOP_SIZE = BUFFER_SIZE  # samples between successive spectra, smaller hops overlap windows
+WINDOW = 'rect'  # analysis window: 'rect', 'hann' or 'blackman'
+BURST_LENGTH = 0.01  # seconds of tone per transmitted burst, still detectable
+
+
+# matplotlib takes longer to import than the rest of SONAR, load it only when plotting
+def pyplot():
+    import matplotlib.pyplot as plt
+    return plt
 
 class SONAR:
     ''' detect hand positions through SONAR '''
-    def __init__(self, samp = SAMPLE_RATE):
+    def __init__(self, samp = SAMPLE_RATE, hop = HOP_SIZE, window = WINDOW, backend = None, state = None):
         # audio parameters setup
         self.fs = samp  # audio sample rate
         self.chunk = BUFFER_SIZE
-        self.p = pyaudio.PyAudio()
+        if hop <= 0 or self.chunk % hop != 0:
+            raise ValueError("hop size must divide the window size %d" % self.chunk)
+        self.hop = hop  # a new spectrum is computed every hop samples
+        self.hops_per_window = self.chunk // hop
+        self.window = window
         self.num_channels = 1  # use mono output for now
-        self.format = pyaudio.paFloat32
-
-        # stream for signal output
-        # 'output = True' indicates that the sound will be played rather than recorded
-        # I have absolutely no idea what device_index is for but it prevents segfaults
-        self.output_stream = self.p.open(format = self.format,
-                                frames_per_buffer = self.chunk,
-                                channels = self.num_channels,
-                                rate = self.fs,
-                                output = True,
-                                output_device_index = None)
-        # stream for receiving signals
-        self.input_stream = self.p.open(format = self.format,
-                                channels = self.num_channels,
-                                rate = self.fs,
-                                frames_per_buffer = self.chunk,
-                                input = True,
-                                input_device_index = None)
+
+        # sound card by default, or a WAV file / synthetic stand-in for headless runs
+        self.backend = PyAudioBackend() if backend is None else backend
+        # blocking stream for file playback, opened on first use; tones use their own callback stream
+        self.output_stream = None
+        # stream for receiving signals, the backend fills the ring buffer
+        self.in_buffer = RingBuffer(RING_WINDOWS * self.chunk)
+        self.input_stream = self.backend.open_input(self.fs, self.chunk, self.in_buffer)
 
         # allow other threads to abort this one
         self.terminate = False
@@ -58,209 +77,337 @@ class SONAR:
         # set indices on frequency range
         self.low_ind = 0
         self.high_ind = 0
+        # compute the band magnitudes of one window, for every hop and for whole windows
+        self.spectrum = None
+        self.window_spectrum = None
+        # the last WIDTH thresholded spectra computed by receive_burst, one row per hop
+        self.spectrogram = None
+        self._make_spectral_engines()
 
         self.amp = 0.8  # amplitude for signal sending
+        # THRESH_PROP is tuned for rect, tapered windows divide it by their noise bandwidth
+        # so that movements last as long whatever the window
+        self.thresh_prop = THRESH_PROP / noise_bandwidth(window)
+        self.carrier_amp = THRESH / THRESH_PROP  # received carrier amplitude, tracked while not moving
+        self.thresh = THRESH  # FFT threshold to filter out noise, thresh_prop * carrier_amp
+        self.calibration_key = None  # cache entry updated by receive_burst, if caching
 
         self.movement_flag = False
-        self.movement_detected = False  # whether there is current motion
-        self.move_count = 0  # most recent count of consecutive movement windows
+        # whether there is current motion and the most recent count of consecutive movement hops,
+        # shared memory when another process reads them
+        self.movement = MovementState() if state is None else state
 
     # allow camera thread to terminate audio threads
     def abort(self):
         self.terminate = True
+
+    # block until a full window of input is buffered and return it as a view
+    # returns None if terminate was set while waiting or the input has ended
+    def read_window(self):
+        while not self.terminate:
+            window = self.in_buffer.wait_window(self.chunk, READ_TIMEOUT)
+            if window is not None or self.in_buffer.closed:
+                return window
+        return None
+
+    # release the window returned by read_window, sliding forward num_samples
+    # (a full window by default)
+    def consume_window(self, num_samples = None):
+        self.in_buffer.advance(self.chunk if num_samples is None else num_samples)
+
+    # read a window of input as raw bytes, for code that needs an owned copy
+    def read_chunk(self):
+        window = self.read_window()
+        if window is None:
+            return b''
+        data = window.tobytes()
+        self.consume_window()
+        return data
                                 
     def set_freq_range(self, low_freq, high_freq):
         self.low_ind = int(low_freq * self.chunk / self.fs)
         self.high_ind = int(high_freq * self.chunk / self.fs)
         self.f_vec = self.f_vec[self.low_ind:self.high_ind]
+        self._make_spectral_engines()
+
+    def _make_spectral_engines(self):
+        self.spectrogram = RingBuffer(WIDTH, frame_shape = (self.high_ind - self.low_ind,))
+        self.window_spectrum = make_spectral_engine(self.chunk, self.low_ind, self.high_ind,
+                                                    window = self.window)
+        if self.hop == self.chunk and SPECTRAL_ENGINE is None:
+            self.spectrum = self.window_spectrum
+        else:
+            self.spectrum = make_spectral_engine(self.chunk, self.low_ind, self.high_ind,
+                                                 SPECTRAL_ENGINE, self.window, self.hop)
 
     # continuously play a tone at frequency freq
     def play_freq(self, freq):
-        cur_frame = 0
-        # signal: sin (2 pi * freq * time)
-        while not self.terminate:
-            # number of frames to produce on this iteration
-            num_frames = self.output_stream.get_write_available()
-            times = np.arange(cur_frame, cur_frame + num_frames) / self.fs
-            arg = times * 2 * np.pi * freq
-            # account for amplitude adjustments
-            signal = self.amp * np.sin(arg)
-            signal = signal.astype(np.float32)
-            # log start of signal transmit as accurately as possible
-            self.output_stream.write(signal.tobytes())
-            cur_frame += num_frames
+        self.play_waveform(tone(freq, self.fs, self.amp, self.chunk))
 
     # periodically transmit a constant frequency signal every interval seconds
-    def transmit(self, freq, interval):
-        #signal_length = 0.01  # still detectable
-        signal_length = 2
+    def transmit(self, freq, interval, length = BURST_LENGTH):
+        self.play_waveform(burst(freq, self.fs, self.amp, length, interval, self.chunk))
+
+    # loop a precomputed waveform through a callback stream until terminate is set
+    def play_waveform(self, waveform):
+        stream = self.backend.open_output(self.fs, self.chunk, waveform.read)
         while not self.terminate:
-            self.play_freq(freq, signal_length)
-            time.sleep(interval - signal_length)
+            time.sleep(READ_TIMEOUT)
+        stream.stop_stream()
+        stream.close()
 
     def play(self, filename):
-        # Open the sound file 
-        wf = wave.open(filename, 'rb')
+        # Memory-map the sound file, only the chunk being played is read from disk
+        info, samples = open_wav(filename)
 
-        if wf.getnchannels() != self.num_channels:
+        if info.channels != self.num_channels:
             raise Exception("Unsupported number of audio channels")
 
-        # Read data in chunks
-        data = wf.readframes(self.chunk)
+        if self.output_stream is None:
+            self.output_stream = self.backend.open_output(self.fs, self.chunk)
 
-        # Play the sound by writing the audio data to the stream
+        # Play the sound by writing the audio data to the stream in chunks
         # check for abort condition
-        while data != b'' and not self.terminate:
-            self.output_stream.write(data)
-            data = wf.readframes(self.chunk)
-
-        wf.close()
+        for start in range(0, info.frames, self.chunk):
+            if self.terminate:
+                break
+            data = to_float32(samples[start:start + self.chunk, 0], info)
+            self.output_stream.write(data.tobytes())
 
     # calibrate thresholds based on audio volume
     # also detect if volume is too low/muted
     # return True if everything is successful
-    def calibrate_thresholds(self, freq):
-        global THRESH  # TODO: don't do this :(
+    # with use_cache, a recent calibration of the same devices and band is
+    # only verified over VERIFY_WINDOWS, falling back to a full calibration if it is off
+    def calibrate_thresholds(self, freq, use_cache = True):
+        key = cache_key(self.backend.device_key(), freq, self.low_ind, self.high_ind,
+                        self.fs, self.chunk, self.window)
+        cached = load_calibration(key) if use_cache else None
+        self.calibration_key = key if use_cache else None
+        num_windows = CALIBRATION_WINDOWS if cached is None else VERIFY_WINDOWS
+
         # first fork a thread to play the frequency
         t = Thread(target = lambda: self.play_freq(freq))
         t.start()
         # very similar audio reading code to receive_burst
         cur_win = 0
-        frames = []
         max_amp = 0
         success = True
-        while cur_win < CALIBRATION_WINDOWS:
-            num_frames = self.input_stream.get_read_available()
-            input_signal = np.frombuffer(self.input_stream.read(num_frames, exception_on_overflow=False), dtype=np.float32)
-            if len(input_signal) > 0:
-                frames = np.concatenate((frames, input_signal))
-            if len(frames) >= self.chunk:
-                fft_data = np.abs(np.fft.rfft(frames[:self.chunk]))[self.low_ind:self.high_ind]
-                if cur_win == 0:
-                    max_amp = np.max(fft_data)
-                else:
-                    max_amp = max_amp * (1 - MOV_AVG_ALPH) + MOV_AVG_ALPH * np.max(fft_data)
-                if max_amp < MIN_ALLOWED_AMP and cur_win >= 20:
-                    print("Please increase your output volume")
-                    success = False
-                    break
-                if ENABLE_DRAW and len(frames) < 1.5 * self.chunk:
-                    fft_data = np.where(fft_data > THRESH, fft_data, 0)
-                    plt.plot(self.f_vec, fft_data)
-                    plt.draw()
-                    plt.pause(1e-6)
-                    plt.clf()
-                frames = frames[self.chunk:]
-                cur_win += 1
+        while cur_win < num_windows:
+            window = self.read_window()
+            if window is None:
+                success = False
+                break
+            fft_data = self.window_spectrum(window)
+            if cur_win == 0:
+                max_amp = np.max(fft_data)
+            else:
+                max_amp = max_amp * (1 - MOV_AVG_ALPH) + MOV_AVG_ALPH * np.max(fft_data)
+            # checked from window 20, or on the last window when only verifying a cached calibration
+            if max_amp < MIN_ALLOWED_AMP and cur_win >= min(20, num_windows - 1):
+                print("Please increase your output volume")
+                success = False
+                break
+            if ENABLE_DRAW and self.in_buffer.available() < 1.5 * self.chunk:
+                fft_data = np.where(fft_data > self.thresh, fft_data, 0)
+                plt = pyplot()
+                plt.plot(self.f_vec, fft_data)
+                plt.draw()
+                plt.pause(1e-6)
+                plt.clf()
+            self.consume_window()
+            cur_win += 1
+            if cur_win == num_windows < CALIBRATION_WINDOWS and \
+                    not cached / VERIFY_TOLERANCE <= max_amp <= cached * VERIFY_TOLERANCE:
+                num_windows = CALIBRATION_WINDOWS  # volume or setup changed, calibrate fully
         self.terminate = True  # abort thread t
         if success: print("Calibration complete")
         t.join()
-        THRESH = THRESH_PROP * max_amp
+        if success:
+            self.set_carrier_amp(max_amp)
+            if use_cache:
+                save_calibration(key, max_amp)
         self.terminate = False
         return success
 
+    def set_carrier_amp(self, amp):
+        self.carrier_amp = amp
+        self.thresh = self.thresh_prop * amp
+
     # detect time it takes for short signal to reach mic
     def receive_burst(self):
-        frames = []
-        prev_window = np.zeros(self.high_ind - self.low_ind)
-
-        num_moves = 0  # number of consecutive windows with movement
-        num_stall = 0  # number of consecutive windows without movement
+        # spectra of the last window's worth of hops; each new spectrum is compared
+        # with the one a full window earlier, so thresholds do not depend on the hop
+        history = np.zeros((self.hops_per_window, self.high_ind - self.low_ind))
+        cur_hop = 0
+        filled = 0  # hops of history computed since the last reset, motion needs a full window of them
+        expected = None  # read position one hop after the previous window
+        self.spectrum.reset()
+
+        num_moves = 0  # number of consecutive hops with movement
+        num_stall = 0  # number of consecutive hops without movement
+        max_stall = STALL_WINDOW_THRESH * self.hops_per_window
+        move_first = 0  # sample index starting the first hop of the current movement
+        # the carrier amplitude follows volume changes, an exponential average over
+        # roughly 1 / ADAPT_ALPH windows of hops without movement
+        adapt = 1 - (1 - ADAPT_ALPH) ** (1 / self.hops_per_window)
+        thresh = self.thresh
+        peak = 0.  # largest difference energy of the current movement
+
+        # look the metrics up once, they are updated every hop
+        dsp_time = METRICS.histogram('sonar.dsp_seconds')
+        windows = METRICS.counter('sonar.windows')
 
         while not self.terminate:
-            num_frames = self.input_stream.get_read_available()
-            input_signal = np.frombuffer(self.input_stream.read(num_frames, exception_on_overflow=False), dtype=np.float32)
-            if len(input_signal) > 0:
-                frames = np.concatenate((frames, input_signal))
-            # wait until we have a full chunk before processing; is this a good idea?
-            if len(frames) >= self.chunk:  # wait until we have a full chunk before processing
-                # fft_data[f] is now the amplitude? of the fth frequency (first two values are garbage)
-                fft_data = np.abs(np.fft.rfft(frames[:self.chunk]))[self.low_ind:self.high_ind]
-                # filter out low amplitudes
-                fft_data = np.where(fft_data < THRESH, 0, fft_data)
-                diff = np.abs(fft_data - prev_window)
-                diff = np.where(diff < 2 * THRESH, 0, diff)
-
-                # filter out single frequency peaks (these tend to be noise)
-                if np.count_nonzero(diff) > 1:  # movement detected
+            # blocks until a full chunk has been captured
+            window = self.read_window()
+            if window is None:
+                break
+            start = time.perf_counter()
+            # an input overflow skipped samples: sliding spectra and the history no longer line up
+            position = self.in_buffer.window_position
+            if expected is not None and position != expected:
+                self.spectrum.reset()
+                history[:] = 0
+                filled = 0
+                METRICS.incr('sonar.resyncs')
+            expected = position + self.hop
+            # fft_data[f] is now the amplitude? of the fth frequency (first two values are garbage)
+            fft_data = self.spectrum(window)
+            # the writer overflowed into the window while it was transformed: drop the torn
+            # spectrum and start over from the new read position, without consuming
+            if not self.in_buffer.window_intact():
+                self.spectrum.reset()
+                history[:] = 0
+                filled = 0
+                expected = None
+                METRICS.incr('sonar.torn_windows')
+                continue
+            # filter out low amplitudes
+            if num_moves == 0:
+                self.set_carrier_amp(self.carrier_amp + adapt * (np.max(fft_data) - self.carrier_amp))
+                thresh = self.thresh
+            fft_data = np.where(fft_data < thresh, 0, fft_data)
+            self.spectrogram.write(fft_data[np.newaxis])
+            diff = np.abs(fft_data - history[cur_hop])
+            diff = np.where(diff < 2 * thresh, 0, diff)
+
+            # filter out single frequency peaks (these tend to be noise)
+            if filled >= self.hops_per_window and np.count_nonzero(diff) > 1:  # movement detected
+                num_moves += 1
+                energy = float(np.dot(diff, diff))
+                if num_moves == 1:
+                    self.movement.set_moving(True)
+                    # the movement starts with the newest hop of the window
+                    move_first = position + self.chunk - self.hop
+                    self.movement.publish_event(MotionEvent(
+                        self.in_buffer.timestamp(move_first, self.fs), None, None, None))
+                    peak = energy
+                elif energy > peak:
+                    peak = energy
+                num_stall = 0
+            elif num_moves > 0:  # movement may have stopped
+                if num_stall < max_stall:
+                    # allow one window of stopped movement
                     num_moves += 1
-                    self.movement_detected = True
-                    num_stall = 0
-                elif num_moves > 0:  # movement may have stopped
-                    if num_stall < STALL_WINDOW_THRESH:
-                        # allow one window of stopped movement
-                        num_moves += 1
-                    else:  # movement has stopped
-                        self.movement_detected = False
-                        self.movement_flag = True
-                        print("Movement ended", num_moves)
-                        # avoid trailing movement overwriting unread existing count
-                        if num_moves > self.move_count:
-                            self.move_count = num_moves
-                        num_moves = 0
-                    num_stall += 1
-
-                # assuming near-ultrasound, the extracted frequency should be approximately the transmitted one
-                #amp = max(fft_data)
-                if ENABLE_DRAW and (len(frames) < 1.5 * self.chunk):  # do not draw every time
-                    plt.plot(self.f_vec, diff)
-                    plt.draw()
-                    plt.pause(1e-6)
-                    plt.clf()
-
-                frames = frames[self.chunk:]  # clear frames already read
-                prev_window = fft_data
+                else:  # movement has stopped
+                    self.movement.set_moving(False)
+                    self.movement_flag = True
+                    # stamped over the num_moves hops counted, so end - start is the duration
+                    self.movement.publish_event(MotionEvent(
+                        self.in_buffer.timestamp(move_first, self.fs),
+                        self.in_buffer.timestamp(move_first + num_moves * self.hop, self.fs),
+                        num_moves * self.hop / self.fs, peak))
+                    METRICS.incr('sonar.movements')
+                    METRICS.observe('sonar.movement_seconds', num_moves * self.hop / self.fs)
+                    METRICS.gauge('sonar.last_movement_end', time.time())
+                    # avoid trailing movement overwriting unread existing count
+                    self.movement.publish_count(num_moves)
+                    num_moves = 0
+                num_stall += 1
+
+            # assuming near-ultrasound, the extracted frequency should be approximately the transmitted one
+            #amp = max(fft_data)
+            if ENABLE_DRAW and self.in_buffer.available() < 1.5 * self.chunk:  # do not draw every time
+                plt = pyplot()
+                plt.plot(self.f_vec, diff)
+                plt.draw()
+                plt.pause(1e-6)
+                plt.clf()
+
+            self.consume_window(self.hop)  # slide forward by one hop
+            history[cur_hop] = fft_data
+            cur_hop = (cur_hop + 1) % self.hops_per_window
+            filled += 1
+
+            dsp_time.observe(time.perf_counter() - start)
+            windows.incr()
+            METRICS.gauge('sonar.ring_fill', self.in_buffer.available())
+            METRICS.gauge('sonar.input_overflows', self.in_buffer.overflows + self.backend.input_overflows)
+            METRICS.gauge('sonar.thresh', thresh)
+
+        # start the next launch's verification from where the volume ended up,
+        # unless it ended up muted, which the next launch should warn about
+        if self.calibration_key is not None and self.carrier_amp >= MIN_ALLOWED_AMP:
+            save_calibration(self.calibration_key, self.carrier_amp)
 
     def is_moving(self):
-        return self.movement_detected
+        return self.movement.is_moving()
 
-    # read the most recent movement window count (0 if not moving)
+    # read the most recent movement hop count (0 if not moving)
     def read_move_count(self):
-        count = self.move_count
-        self.move_count = 0
-        return count
+        return self.movement.read_count()
+
+    # read the duration in seconds of the most recent movement (0 if not moving)
+    def read_move_duration(self):
+        return self.read_move_count() * self.hop / self.fs
+
+    # the last WIDTH spectra as a read-only (WIDTH, bins) float32 view, oldest first,
+    # zeros before enough hops were processed; nothing is copied, so the oldest row is
+    # replaced at the next hop; pass out to take a stable copy instead
+    def spectrogram_snapshot(self, out = None):
+        snapshot = self.spectrogram.latest(WIDTH)
+        if out is None:
+            return snapshot
+        np.copyto(out, snapshot)
+        return out
+
+    # every MotionEvent since the last call, for consumers that must not miss short movements
+    def drain_events(self):
+        return self.movement.drain_events()
             
-    # record audio input and write to filename
-    def record(self, filename):
-        seconds = 10
+    # record audio input to filename as it arrives, for seconds or until aborted or the input ends
+    # with spectrogram, the band magnitudes of every window are saved next to it, see WavRecorder
+    def record(self, filename, seconds = None, spectrogram = False):
         print('Recording')
-
-        frames = []  # Initialize array to store frames
-
-        # Store data in chunks for 3 seconds
-        for i in range(0, int(self.fs / self.chunk * seconds)):
-            if self.terminate: break
-            data = self.input_stream.read(self.chunk)
-
-            # Visualize: 
-            # https://makersportal.com/blog/2018/9/17/audio-processing-in-python-part-ii-exploring-windowing-sound-pressure-levels-and-a-weighting-using-an-iphone-x
-            data_int = np.array(struct.unpack(str(self.chunk*2) + 'B', data), dtype='b')[::2]
-            fft_data = (np.abs(np.fft.fft(data_int))[0:int(np.floor(self.chunk/2))])/self.chunk
-            fft_data[1:] = 2*fft_data[1:]
-            plt.plot(self.f_vec,fft_data)
-            
-            frames.append(data)
+        # before set_freq_range the whole spectrum is kept
+        band = (self.chunk, self.low_ind, self.high_ind or self.chunk // 2 + 1)
+        recorder = WavRecorder(filename, self.fs, band if spectrogram else None)
+        limit = None if seconds is None else int(seconds * self.fs)
+
+        # each window goes straight to disk, nothing accumulates in memory
+        try:
+            while limit is None or recorder.frames < limit:
+                window = self.read_window()
+                if window is None:
+                    break
+                n = self.chunk if limit is None else min(self.chunk, limit - recorder.frames)
+                recorder.write(window[:n])
+                self.consume_window()
+        finally:
+            recorder.close()
 
         # Stop the stream
         self.input_stream.stop_stream()
 
         print('Finished recording')
-        plt.show()
-
-        # Save the recorded data as a WAV file
-        wf = wave.open(filename, 'wb')
-        wf.setnchannels(self.num_channels)
-        wf.setsampwidth(self.p.get_sample_size(self.format))
-        wf.setframerate(self.fs)
-        wf.writeframes(b''.join(frames))
-        wf.close()
-
 
     # Records two windows and subtracts them from each other
     def subtract_window(self):
-        data = [self.input_stream.read(self.chunk) for _ in range(2)]
+        data = [self.read_chunk() for _ in range(2)]
         data_int = [np.array(struct.unpack(str(self.chunk*2) + 'B', data[i]), dtype='b')[::2] for i in range(2)]
         fft_data = [(np.abs(np.fft.fft(data))[0:int(np.floor(self.chunk/2))])/self.chunk for data in data_int]
+        plt = pyplot()
         plt.plot(self.f_vec, fft_data[0])
         plt.plot(self.f_vec, fft_data[1])
         fft_subtract = np.subtract(fft_data[1], fft_data[0])
@@ -270,9 +417,10 @@ class SONAR:
 
     # close all streams and terminate PortAudio interface
     def destruct(self):
-        self.output_stream.close()
+        if self.output_stream is not None:
+            self.output_stream.close()
         self.input_stream.close()
-        self.p.terminate()
+        self.backend.terminate()
 
     def detect_movement(self):
         self.set_freq_range(220, 1760)
@@ -0,0 +1,263 @@
+import os
+import threading
+import sys
+import time
+import numpy as np
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("/".join(path.split('/')[:-2]))
+
+from src.SONAR.wavio import open_wav, to_float32
+
+
+class AudioBackend:
+    ''' where SONAR gets its input audio from and sends its output audio to
+
+    open_input starts delivering float32 mono samples into a RingBuffer and
+    returns a stream object with stop_stream() and close(); open_output returns
+    a blocking stream with get_write_available() and write(bytes), or with a
+    source, a stream that pulls float32 blocks from source(num_samples) itself '''
+    realtime = True  # whether input arrives at the sample rate on its own
+    sample_size = 4  # bytes per sample, audio is float32 throughout
+    input_overflows = 0  # number of input callbacks reporting dropped audio
+
+    def open_input(self, fs, chunk, sink):
+        raise NotImplementedError
+
+    def open_output(self, fs, chunk, source = None):
+        return NullOutputStream(fs, chunk, source)
+
+    # names the input and output devices, calibrations are cached per key
+    def device_key(self):
+        return type(self).__name__
+
+    def terminate(self):
+        pass
+
+
+class PyAudioBackend(AudioBackend):
+    ''' real sound card input and output through PortAudio '''
+    def __init__(self, input_device_index = None, output_device_index = None):
+        import pyaudio  # only needed when talking to real hardware
+        self._pa = pyaudio
+        self.p = pyaudio.PyAudio()
+        self.format = pyaudio.paFloat32
+        # I have absolutely no idea what device_index is for but it prevents segfaults
+        self.input_device_index = input_device_index
+        self.output_device_index = output_device_index
+
+    def device_key(self):
+        names = []
+        for index, default in ((self.input_device_index, self.p.get_default_input_device_info),
+                               (self.output_device_index, self.p.get_default_output_device_info)):
+            try:
+                info = default() if index is None else self.p.get_device_info_by_index(index)
+                names.append(info['name'])
+            except IOError:  # no such device, PortAudio will complain when it is opened
+                names.append(str(index))
+        return 'pyaudio:%s>%s' % tuple(names)
+
+    def open_output(self, fs, chunk, source = None):
+        # PortAudio pulls each block from the source on its own thread
+        # source returns a float32 array, PyAudio accepts it without a copy to bytes
+        callback = None
+        if source is not None:
+            def callback(in_data, frame_count, time_info, status):
+                return (source(frame_count), self._pa.paContinue)
+
+        # 'output = True' indicates that the sound will be played rather than recorded
+        return self.p.open(format = self.format,
+                           frames_per_buffer = chunk,
+                           channels = 1,
+                           rate = fs,
+                           output = True,
+                           output_device_index = self.output_device_index,
+                           stream_callback = callback)
+
+    def open_input(self, fs, chunk, sink):
+        # PortAudio pushes captured audio into the ring buffer from its own thread
+        def callback(in_data, frame_count, time_info, status):
+            if status & self._pa.paInputOverflow:
+                self.input_overflows += 1
+            sink.write(np.frombuffer(in_data, dtype=np.float32))
+            return (None, self._pa.paContinue)
+
+        return self.p.open(format = self.format,
+                           channels = 1,
+                           rate = fs,
+                           frames_per_buffer = chunk,
+                           input = True,
+                           input_device_index = self.input_device_index,
+                           stream_callback = callback)
+
+    def terminate(self):
+        self.p.terminate()
+
+
+class NullOutputStream:
+    ''' stands in for a sound card output: consumes audio at the sample rate and discards it
+
+    with a source, a background thread pulls a chunk from it every chunk / fs
+    seconds, like a callback stream '''
+    def __init__(self, fs, chunk = None, source = None):
+        self.fs = fs
+        self._stop = threading.Event()
+        self._thread = None
+        if source is not None:
+            self._thread = threading.Thread(target = lambda: self._pull(source, chunk), daemon = True)
+            self._thread.start()
+
+    def _pull(self, source, chunk):
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            source(chunk)
+            next_time += chunk / self.fs
+            self._stop.wait(max(next_time - time.monotonic(), 0))
+
+    def get_write_available(self):
+        return self.fs // 100
+
+    def write(self, data):
+        time.sleep(len(data) / 4 / self.fs)
+
+    def stop_stream(self):
+        self._stop.set()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class _FeederStream:
+    ''' pushes generated chunks into a ring buffer from a background thread
+
+    in real-time mode chunks are paced at the sample rate like a sound card,
+    otherwise the feeder only waits for the reader to make room, so a
+    recording is processed as fast as the DSP can go '''
+    def __init__(self, generate, fs, sink, realtime, on_close = None):
+        self._generate = generate  # returns the next float32 chunk, or None at the end
+        self._fs = fs
+        self._sink = sink
+        self._realtime = realtime
+        self._on_close = on_close
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            samples = self._generate()
+            if samples is None:
+                break
+            if self._realtime:
+                next_time += len(samples) / self._fs
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                while not self._stop.is_set() and not self._sink.wait_space(len(samples), 0.1):
+                    pass
+            self._sink.write(samples)
+        self._sink.close()
+        if self._on_close is not None:
+            self._on_close()
+
+    def stop_stream(self):
+        self._stop.set()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class WaveFileBackend(AudioBackend):
+    ''' replay a recorded WAV file as SONAR input, faster than real time by default
+
+    the samples are memory-mapped, so even long recordings cost almost no RAM
+    8, 16 and 32 bit PCM and float32 files such as those written by SONAR.record are supported '''
+    def __init__(self, filename, loop = False, realtime = False):
+        self.filename = filename
+        self.loop = loop
+        self.realtime = realtime
+
+    def device_key(self):
+        return 'wave:%s' % os.path.abspath(self.filename)
+
+    def open_input(self, fs, chunk, sink):
+        info, samples = open_wav(self.filename)
+        if info.fs != fs:
+            raise ValueError("%s is sampled at %d Hz, expected %d Hz" % (self.filename, info.fs, fs))
+        state = {'pos': 0}
+
+        def generate():
+            pos = state['pos']
+            if pos >= info.frames and self.loop:
+                pos = 0
+            if pos >= info.frames:
+                return None
+            state['pos'] = pos + chunk
+            # keep the first channel only
+            return to_float32(samples[pos:pos + chunk, 0], info)
+
+        return _FeederStream(generate, fs, sink, self.realtime)
+
+
+class SyntheticBackend(AudioBackend):
+    ''' carrier tone plus the Doppler-shifted echo of simulated hand movements
+
+    movements is a list of (start, length, peak_velocity) in seconds and m/s;
+    during a movement the hand's velocity follows half a sine period, which
+    shifts the echo to freq * (1 + 2 v / c) '''
+    def __init__(self, freq = 19000, movements = (), duration = None, amp = 0.5,
+                 echo_amp = 0.1, noise = 0.01, realtime = False, seed = 0, sound_speed = 343):
+        self.freq = freq
+        self.movements = list(movements)
+        self.duration = duration  # seconds of audio to generate, None for endless
+        self.amp = amp
+        self.echo_amp = echo_amp
+        self.noise = noise
+        self.realtime = realtime
+        self.seed = seed
+        self.sound_speed = sound_speed
+
+    def open_input(self, fs, chunk, sink):
+        rng = np.random.default_rng(self.seed)
+        total = None if self.duration is None else int(self.duration * fs)
+        state = {'n': 0, 'echo_phase': 0.0, 'first': 0}
+        # sorted by start, so each chunk only looks at the movements that can overlap it
+        movements = sorted(self.movements)
+        starts = np.array([start for start, _, _ in movements])
+
+        def generate():
+            n = state['n']
+            if total is not None and n >= total:
+                return None
+            count = chunk if total is None else min(chunk, total - n)
+            t = (n + np.arange(count)) / fs
+
+            velocity = np.zeros(count)
+            # movements before first have all ended, those from stop on have not started yet
+            first = state['first']
+            while first < len(movements) and sum(movements[first][:2]) < t[0]:
+                first += 1
+            state['first'] = first
+            stop = np.searchsorted(starts, t[-1])
+            for start, length, peak in movements[first:stop]:
+                if start + length < t[0]:  # ended, but after a longer movement that has not
+                    continue
+                inside = (t >= start) & (t < start + length)
+                velocity[inside] += peak * np.sin(np.pi * (t[inside] - start) / length)
+            echo_freq = self.freq * (1 + 2 * velocity / self.sound_speed)
+            echo_phase = state['echo_phase'] + 2 * np.pi * np.cumsum(echo_freq) / fs
+
+            signal = self.amp * np.sin(2 * np.pi * self.freq * t)
+            signal += self.echo_amp * np.sin(echo_phase)
+            signal += self.noise * rng.standard_normal(count)
+
+            state['n'] = n + count
+            state['echo_phase'] = echo_phase[-1] % (2 * np.pi)
+            return signal.astype(np.float32)
+
+        return _FeederStream(generate, fs, sink, self.realtime)
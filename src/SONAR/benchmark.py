@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import timeit
+import numpy as np
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("/".join(path.split('/')[:-2]))
+
+from src.metrics import METRICS
+from src.SONAR.audio import SONAR, SAMPLE_RATE, BUFFER_SIZE
+from src.SONAR.backends import SyntheticBackend
+from src.SONAR.spectral import ENGINES, SlidingDFT, make_spectral_engine
+
+NUM_RUNS = 5000  # windows timed per engine
+
+
+# time every spectral engine on one band and compare it against the rfft path
+def benchmark_spectral(low_freq, high_freq, fs = SAMPLE_RATE, chunk = BUFFER_SIZE, hop = 256):
+    low_ind = int(low_freq * chunk / fs)
+    high_ind = int(high_freq * chunk / fs)
+    signal = np.random.default_rng(0).standard_normal(2 * chunk).astype(np.float32)
+    window = signal[:chunk]
+
+    reference = ENGINES['rfft'](chunk, low_ind, high_ind)
+    expected = reference(window)
+    auto = make_spectral_engine(chunk, low_ind, high_ind).name
+    print('%d-%d Hz: %d bins of a %d-sample window (auto: %s)' % (
+        low_freq, high_freq, high_ind - low_ind, chunk, auto))
+
+    base = None
+    for name in ('rfft', 'dft'):
+        engine = ENGINES[name](chunk, low_ind, high_ind)
+        err = np.max(np.abs(engine(window) - expected)) / np.max(expected)
+        usec = timeit.timeit(lambda: engine(window), number = NUM_RUNS) / NUM_RUNS * 1e6
+        if base is None:
+            base = usec
+        print('  %-7s %8.1f us/window  %5.2fx  rel err %.1e' % (name, usec, base / usec, err))
+
+    # the sliding DFT only makes sense hop by hop, it replaces one full transform per hop
+    engine = SlidingDFT(chunk, low_ind, high_ind, hop = hop)
+    engine(window)
+    last = signal[hop:hop + chunk]
+    err = np.max(np.abs(engine(last) - reference(last))) / np.max(expected)
+    hops = [signal[i:i + chunk] for i in range(0, chunk, hop)]
+    def run():
+        for w in hops:
+            engine(w)
+    usec = timeit.timeit(run, number = NUM_RUNS // len(hops)) / (NUM_RUNS // len(hops) * len(hops)) * 1e6
+    print('  %-7s %8.1f us/hop     %5.2fx  rel err %.1e  (hop %d)' % ('sliding', usec, base / usec, err, hop))
+
+
+# run calibration and movement detection over synthetic audio as fast as possible
+# a movement of MOVE_LENGTH seconds starts every MOVE_PERIOD seconds
+def benchmark_replay(seconds, hop = BUFFER_SIZE, freq = 19000, move_length = 0.4, move_period = 2.0):
+    movements = [(start, move_length, 0.5) for start in np.arange(1, seconds - move_length, move_period)]
+    s = SONAR(hop = hop, backend = SyntheticBackend(freq, movements, duration = seconds))
+    s.set_freq_range(18000, 20000)
+
+    start = time.perf_counter()
+    s.calibrate_thresholds(freq, use_cache = False)
+    s.receive_burst()
+    elapsed = time.perf_counter() - start
+    s.destruct()
+    print('hop %4d: %.0f s of audio in %.2f s (%.0fx real time), %d movements simulated' % (
+        hop, seconds, elapsed, seconds / elapsed, len(movements)))
+    dsp = METRICS.histogram('sonar.dsp_seconds')
+    print('          dsp p50 %.1f us, p99 %.1f us per hop' % (dsp.quantile(0.5) * 1e6, dsp.quantile(0.99) * 1e6))
+    METRICS.histograms.clear()
+
+
+if __name__ == "__main__":
+    benchmark_spectral(18000, 20000)
+    benchmark_spectral(18500, 19500)
+    benchmark_spectral(18900, 19100)
+    benchmark_replay(600)
+    benchmark_replay(600, hop = 512)
@@ -0,0 +1,38 @@
+import json
+import os
+import time
+
+path = os.path.dirname(os.path.realpath(__file__))
+
+CACHE_PATH = os.path.join(path, '.calibration.json')  # calibration results of every device seen
+CACHE_TTL = 7 * 24 * 3600  # seconds before a cached calibration is no longer trusted
+
+
+# identifies what a calibration is valid for: the devices, the band and the analysis setup
+def cache_key(device, freq, low_ind, high_ind, fs, chunk, window):
+    return '%s|%g Hz|%d-%d|%d|%d|%s' % (device, freq, low_ind, high_ind, fs, chunk, window)
+
+
+def _load(cache_path):
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):  # missing or corrupt, start over
+        return {}
+
+
+# cached carrier amplitude for key, or None if absent or older than ttl seconds
+def load_calibration(key, cache_path = CACHE_PATH, ttl = CACHE_TTL):
+    entry = _load(cache_path).get(key)
+    if entry is None or time.time() - entry['time'] > ttl:
+        return None
+    return entry['max_amp']
+
+
+def save_calibration(key, max_amp, cache_path = CACHE_PATH):
+    cache = _load(cache_path)
+    cache[key] = {'max_amp': float(max_amp), 'time': time.time()}
+    # write then rename, so a crash never leaves a truncated cache
+    with open(cache_path + '.tmp', 'w') as f:
+        json.dump(cache, f, indent = 1)
+    os.replace(cache_path + '.tmp', cache_path)
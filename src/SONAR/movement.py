@@ -0,0 +1,117 @@
+import multiprocessing
+import queue
+from collections import deque, namedtuple
+
+from src.metrics import METRICS
+
+# slots of SharedMovementState's shared array
+MOVING = 0  # 1 while the receiver sees movement
+COUNT = 1  # hop count of the latest finished movement
+SEQ = 2  # bumped by the writer after each published count
+ACK = 3  # last SEQ the reader consumed
+
+# undrained motion events kept, the oldest are dropped past this
+MAX_EVENTS = 256
+
+# start and end are time.monotonic() seconds bounding the hops of the movement,
+# counted at the sample rate from the first input sample, so end - start is
+# duration, in seconds like SONAR.read_move_duration; peak is the largest
+# spectral difference energy seen; movements in progress are published
+# with end, duration and peak set to None
+MotionEvent = namedtuple('MotionEvent', ['start', 'end', 'duration', 'peak'])
+
+
+class MovementState:
+    ''' movement results published by SONAR.receive_burst, for readers in the same process '''
+    def __init__(self):
+        self.moving = False
+        self.count = 0
+        self.events = deque(maxlen = MAX_EVENTS)
+
+    def set_moving(self, moving):
+        self.moving = moving
+
+    # publish the hop count of a finished movement, a larger unread count is kept
+    def publish_count(self, count):
+        if count > self.count:
+            self.count = count
+
+    def is_moving(self):
+        return self.moving
+
+    # read the latest movement hop count and reset it (0 if nothing new)
+    def read_count(self):
+        count = self.count
+        self.count = 0
+        return count
+
+    # queue a MotionEvent, dropping the oldest one if nobody drained MAX_EVENTS of them
+    def publish_event(self, event):
+        if len(self.events) == MAX_EVENTS:
+            METRICS.incr('sonar.events_dropped')
+        self.events.append(event)
+
+    # every MotionEvent published since the last call, oldest first, never blocks
+    def drain_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.popleft())
+            except IndexError:
+                return events
+
+
+class SharedMovementState(MovementState):
+    ''' the same results in a shared int64 array, so a process running SONAR
+    can publish them to another without locks
+
+    one process writes MOVING, COUNT and SEQ, the other only writes ACK;
+    the reader retries if SEQ moved while it was reading COUNT; motion events
+    go through a multiprocessing queue of MAX_EVENTS '''
+    def __init__(self, ctx = multiprocessing):
+        self._slots = ctx.RawArray('q', 4)
+        self.events = ctx.Queue(MAX_EVENTS)
+
+    def set_moving(self, moving):
+        self._slots[MOVING] = int(moving)
+
+    def publish_count(self, count):
+        if self._slots[SEQ] != self._slots[ACK]:  # previous count not read yet
+            count = max(count, self._slots[COUNT])
+        self._slots[COUNT] = count
+        self._slots[SEQ] += 1
+
+    def is_moving(self):
+        return bool(self._slots[MOVING])
+
+    def read_count(self):
+        while True:
+            seq = self._slots[SEQ]
+            if seq == self._slots[ACK]:
+                return 0
+            count = self._slots[COUNT]
+            if self._slots[SEQ] == seq:
+                break
+        self._slots[ACK] = seq
+        return count
+
+    # the writer makes room by taking the oldest event itself, the queue never blocks it
+    def publish_event(self, event):
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                    METRICS.incr('sonar.events_dropped')
+                except queue.Empty:  # drained meanwhile
+                    pass
+
+    def drain_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
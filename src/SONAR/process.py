@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from threading import Thread
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("/".join(path.split('/')[:-2]))
+
+from src.SONAR.audio import SONAR, SAMPLE_RATE, HOP_SIZE, WINDOW, READ_TIMEOUT
+from src.SONAR.movement import SharedMovementState
+
+EVENT_TIMEOUT = 0.5  # seconds between liveness checks while waiting on the child
+
+
+# body of the SONAR process: calibrate, then transmit and receive until stopped
+def _run_sonar(low_freq, high_freq, freq, samp, hop, window, backend, state, events, stop):
+    # motion events nobody drained are dropped at exit instead of blocking it
+    state.events.cancel_join_thread()
+    s = SONAR(samp, hop, window, backend, state)
+    s.set_freq_range(low_freq, high_freq)
+
+    # the parent aborts us through the shared stop flag; a multiprocessing.Event
+    # would deadlock the parent's set() if we exited while waiting on it
+    def watch():
+        while not stop.value:
+            time.sleep(READ_TIMEOUT)
+        s.abort()
+    Thread(target = watch, daemon = True).start()
+
+    success = s.calibrate_thresholds(freq) and not stop.value
+    events.put(('calibrated', success))
+    if success:
+        transmitter = Thread(target = lambda: s.play_freq(freq))
+        transmitter.start()
+        s.receive_burst()
+        s.abort()
+        transmitter.join()
+    s.destruct()
+    events.put(('stopped', None))
+
+
+class SonarProcess:
+    ''' runs the SONAR transmitter and receiver in a child process
+
+    the numpy DSP and tone generation then get their own interpreter instead of
+    competing with the camera loop for the GIL; movement results come back
+    through shared memory, so is_moving and read_move_duration never block and
+    this object can stand in for a SONAR in detect_signs '''
+    def __init__(self, low_freq, high_freq, freq, samp = SAMPLE_RATE, hop = HOP_SIZE,
+                 window = WINDOW, backend = None):
+        # spawn rather than fork, PortAudio does not survive a fork with live threads
+        ctx = multiprocessing.get_context('spawn')
+        self.fs = samp
+        self.hop = hop
+        self.movement_flag = False
+        self.state = SharedMovementState(ctx)
+        self.events = ctx.Queue()  # ('calibrated', success) then ('stopped', None)
+        self._stop = ctx.RawValue('b', 0)
+        # backend None opens the sound card in the child, any other backend must be picklable
+        self.process = ctx.Process(target = _run_sonar, daemon = True,
+                                   args = (low_freq, high_freq, freq, samp, hop, window, backend,
+                                           self.state, self.events, self._stop))
+
+    def start(self):
+        self.process.start()
+
+    # block until the child has calibrated, return whether it succeeded
+    def wait_calibrated(self):
+        while True:
+            try:
+                kind, value = self.events.get(timeout = EVENT_TIMEOUT)
+            except queue.Empty:  # check that the child is still alive
+                if not self.process.is_alive():
+                    return False
+                continue
+            if kind == 'calibrated':
+                return value
+            if kind == 'stopped':
+                return False
+
+    def is_moving(self):
+        return self.state.is_moving()
+
+    # read the most recent movement hop count (0 if not moving)
+    def read_move_count(self):
+        return self.state.read_count()
+
+    # read the duration in seconds of the most recent movement (0 if not moving)
+    def read_move_duration(self):
+        return self.read_move_count() * self.hop / self.fs
+
+    # every MotionEvent since the last call; time.monotonic() is system-wide, so
+    # the child's timestamps line up with frame capture times in this process
+    def drain_events(self):
+        return self.state.drain_events()
+
+    # allow camera thread to stop the SONAR process
+    def abort(self):
+        self._stop.value = 1
+
+    def join(self):
+        self.process.join()
@@ -0,0 +1,117 @@
+import threading
+import time
+import numpy as np
+
+
+class RingBuffer:
+    ''' preallocated single-producer / single-consumer sample buffer
+
+    every sample is stored twice (at i and i + capacity), so any window of up
+    to capacity samples can be handed out as one contiguous view, no copying;
+    with a frame_shape each sample is an array of that shape, e.g. one spectrum '''
+    def __init__(self, capacity, dtype = np.float32, frame_shape = ()):
+        self.capacity = capacity
+        self._data = np.zeros((2 * capacity,) + tuple(frame_shape), dtype = dtype)
+        self._written = 0  # total number of samples ever written
+        self._read = 0  # total number of samples consumed by the reader
+        self.window_position = 0  # read position of the window last returned by wait_window
+        self._cond = threading.Condition()
+
+        self.overflows = 0  # number of samples dropped because the reader fell behind
+        self.clock = None  # time.monotonic() and samples written at the end of the first write
+        self.closed = False  # set by the writer once no more samples will arrive
+
+    # number of samples waiting to be consumed
+    def available(self):
+        return self._written - self._read
+
+    # index of the next sample to be consumed, counting from the first sample ever written
+    def read_position(self):
+        return self._read
+
+    # time.monotonic() at which sample index arrived, counted at fs from the first write,
+    # so input faster than real time (e.g. a WAV file replay) is stamped at its own pace
+    def timestamp(self, index, fs):
+        clock_time, clock_index = self.clock
+        return clock_time + (index - clock_index) / fs
+
+    # copy samples into the buffer, dropping the oldest unread data if full
+    # meant to be called from the audio callback, so it never blocks
+    def write(self, samples):
+        cap = self.capacity
+        skipped = max(len(samples) - cap, 0)
+        samples = samples[skipped:]
+        n = len(samples)
+
+        # move the reader past the data about to be overwritten before touching it,
+        # so window_intact sees any overwrite that has started
+        with self._cond:
+            lag = self._written + skipped + n - self._read
+            if lag > cap:
+                self.overflows += lag - cap
+                self._read += lag - cap
+
+        start = (self._written + skipped) % cap
+        first = min(n, cap - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[start + cap:start + cap + first] = samples[:first]
+        rest = n - first
+        if rest > 0:
+            self._data[:rest] = samples[first:]
+            self._data[cap:cap + rest] = samples[first:]
+
+        with self._cond:
+            self._written += skipped + n
+            if self.clock is None:
+                self.clock = (time.monotonic(), self._written)
+            self._cond.notify_all()
+
+    # block until n samples can be written without dropping unread data
+    # used by sources that are faster than real time and can wait for the reader
+    def wait_space(self, n, timeout = None):
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self.closed or self.capacity - (self._written - self._read) >= n, timeout)
+
+    # signal end of input, waking up a blocked reader
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    # block until n samples are available and return them as a read-only view
+    # returns None on timeout or once closed; the view stays valid until advance() is called
+    def wait_window(self, n, timeout = None):
+        with self._cond:
+            if not self._cond.wait_for(
+                    lambda: self.closed or self._written - self._read >= n, timeout):
+                return None
+            if self._written - self._read < n:
+                return None
+            self.window_position = self._read
+            start = self._read % self.capacity
+        window = self._data[start:start + n]
+        window.flags.writeable = False
+        return window
+
+    # whether the window last returned by wait_window still holds its samples; a writer
+    # overflowing the buffer moves the read position before overwriting the oldest ones
+    def window_intact(self):
+        with self._cond:
+            return self._read == self.window_position
+
+    # the newest n samples as a read-only view, without consuming them; samples
+    # never written read as zeros. the oldest row is overwritten by the next write
+    def latest(self, n):
+        with self._cond:
+            start = (self._written - n) % self.capacity
+        window = self._data[start:start + n]
+        window.flags.writeable = False
+        return window
+
+    # mark n samples as consumed
+    def advance(self, n):
+        with self._cond:
+            # an overflowing write may have moved the read position ahead of the written samples
+            self._read = max(self._read, min(self._read + n, self._written))
+            self._cond.notify_all()
@@ -0,0 +1,147 @@
+import numpy as np
+
+# a partial DFT costs about one FFT when the band holds this many bins per log2(window size)
+PARTIAL_DFT_BINS_PER_LOG2 = 7
+# recompute the sliding DFT from scratch after this many hops to stop rounding drift
+SLIDING_RESYNC_HOPS = 256
+
+# periodic windows as cosine sums: w[n] = sum_m c_m cos(2 pi m n / N) (with alternating signs),
+# which in the frequency domain is X_w[k] = c_0 X[k] + sum_m s_m (X[k - m] + X[k + m])
+WINDOW_COEFFS = {
+    'rect': (1.0,),
+    'hann': (0.5, -0.25),
+    'blackman': (0.42, -0.25, 0.04),
+}
+
+
+# time-domain samples of a periodic window from WINDOW_COEFFS
+def window_samples(window, chunk):
+    coeffs = WINDOW_COEFFS[window]
+    n = np.arange(chunk)
+    w = np.full(chunk, coeffs[0])
+    for m, c in enumerate(coeffs[1:], 1):
+        w += 2 * c * np.cos(2 * np.pi * m * n / chunk)
+    return w
+
+
+# equivalent noise bandwidth of a window from WINDOW_COEFFS, in bins: N sum(w^2) / sum(w)^2,
+# 1 for rect, 1.5 for hann; a tapered window spreads a tone over a wider main lobe
+def noise_bandwidth(window):
+    coeffs = WINDOW_COEFFS[window]
+    return (coeffs[0] ** 2 + 2 * sum(c ** 2 for c in coeffs[1:])) / coeffs[0] ** 2
+
+
+class RFFTBand:
+    ''' reference engine: full real FFT, then keep the band '''
+    name = 'rfft'
+
+    def __init__(self, chunk, low_ind, high_ind, window = 'rect'):
+        self.chunk = chunk
+        self.low_ind = low_ind
+        self.high_ind = high_ind
+        self._window = None if window == 'rect' else window_samples(window, chunk).astype(np.float32)
+
+    # magnitude of bins low_ind:high_ind for one window of chunk samples
+    def __call__(self, window):
+        if self._window is not None:
+            window = window * self._window
+        return np.abs(np.fft.rfft(window))[self.low_ind:self.high_ind]
+
+    # forget any state carried between calls
+    def reset(self):
+        pass
+
+
+class PartialDFT:
+    ''' compute only the band bins with a precomputed DFT matrix '''
+    name = 'dft'
+
+    def __init__(self, chunk, low_ind, high_ind, window = 'rect'):
+        self.chunk = chunk
+        self.low_ind = low_ind
+        self.high_ind = high_ind
+        self.num_bins = high_ind - low_ind
+
+        # rows are cos then sin of 2 pi k n / N for every bin k in the band,
+        # with the analysis window folded in so it costs nothing per call
+        n = np.arange(chunk)
+        k = np.arange(low_ind, high_ind)[:, None]
+        arg = 2 * np.pi * ((k * n) % chunk) / chunk
+        w = window_samples(window, chunk)
+        self._basis = (np.vstack((np.cos(arg), np.sin(arg))) * w).astype(np.float32)
+        self._out = np.empty(2 * self.num_bins, dtype = np.float32)
+
+    def __call__(self, window):
+        np.dot(self._basis, window, out = self._out)
+        return np.hypot(self._out[:self.num_bins], self._out[self.num_bins:])
+
+    def reset(self):
+        pass
+
+
+class SlidingDFT:
+    ''' update the band bins incrementally as each hop of samples arrives
+
+    X_k(t + H) = e^(2 pi j k H / N) (X_k(t) + sum_i (x_new[i] - x_old[i]) e^(-2 pi j k i / N))
+    so each hop costs one (bins x hop) product instead of a whole window.
+    consecutive calls must be given windows exactly hop samples apart '''
+    name = 'sliding'
+
+    def __init__(self, chunk, low_ind, high_ind, window = 'rect', hop = None):
+        self.chunk = chunk
+        self.hop = chunk if hop is None else hop
+        self.low_ind = low_ind
+        self.high_ind = high_ind
+
+        # windowing in the frequency domain needs a few extra bins on each side
+        self._coeffs = np.array(WINDOW_COEFFS[window])
+        self._pad = len(self._coeffs) - 1
+        k = np.arange(low_ind - self._pad, high_ind + self._pad)
+        self._full = np.exp(-2j * np.pi * ((k[:, None] * np.arange(chunk)) % chunk) / chunk)
+        self._delta = self._full[:, :self.hop]
+        self._rotate = np.exp(2j * np.pi * ((k * self.hop) % chunk) / chunk)
+
+        self._bins = np.zeros(len(k), dtype = np.complex128)
+        self._oldest = np.zeros(self.hop, dtype = np.float64)  # first hop of the previous window
+        self._since_sync = None  # hops since the bins were computed directly
+
+    def reset(self):
+        self._since_sync = None
+
+    def __call__(self, window):
+        if self._since_sync is None or self._since_sync >= SLIDING_RESYNC_HOPS:
+            np.dot(self._full, window, out = self._bins)
+            self._since_sync = 0
+        else:
+            step = window[-self.hop:] - self._oldest
+            self._bins += self._delta @ step
+            self._bins *= self._rotate
+            self._since_sync += 1
+        self._oldest[:] = window[:self.hop]
+
+        pad = self._pad
+        num_bins = self.high_ind - self.low_ind
+        out = self._coeffs[0] * self._bins[pad:pad + num_bins]
+        for m, c in enumerate(self._coeffs[1:], 1):
+            out += c * (self._bins[pad - m:pad - m + num_bins] + self._bins[pad + m:pad + m + num_bins])
+        return np.abs(out)
+
+
+ENGINES = {engine.name: engine for engine in (RFFTBand, PartialDFT, SlidingDFT)}
+
+
+# pick the cheapest engine for the band: the partial DFT scales with the number
+# of bins, the FFT with N log N regardless of how much of it we keep, and
+# overlapping hops are cheapest to update incrementally
+def make_spectral_engine(chunk, low_ind, high_ind, name = None, window = 'rect', hop = None):
+    if name is None:
+        num_bins = high_ind - low_ind
+        if hop is not None and hop < chunk:
+            name = SlidingDFT.name
+        elif num_bins <= PARTIAL_DFT_BINS_PER_LOG2 * np.log2(chunk):
+            name = PartialDFT.name
+        else:
+            name = RFFTBand.name
+    if name == SlidingDFT.name:
+        return SlidingDFT(chunk, low_ind, high_ind, window, hop)
+    return ENGINES[name](chunk, low_ind, high_ind, window)
@@ -0,0 +1,54 @@
+from fractions import Fraction
+import numpy as np
+
+MAX_PERIOD = 1 << 16  # longest exact period in samples, frequencies are rounded to fit
+RAMP = 0.002  # seconds of raised-cosine fade at each end of a burst, avoids clicks
+
+
+class Waveform:
+    ''' one precomputed period of a signal, played back as a loop
+
+    the period is tiled so that any block of up to max_block samples is a
+    contiguous slice; read() returns views of it, so an output callback never
+    allocates and the position is an exact integer that cannot drift '''
+    def __init__(self, period, max_block):
+        self.period = np.asarray(period, dtype = np.float32)
+        self.pos = 0
+        self._tile(max_block)
+
+    def _tile(self, max_block):
+        n = len(self.period)
+        self.max_block = max_block
+        self._table = np.tile(self.period, -(-(n + max_block) // n))
+        self._table.flags.writeable = False
+
+    # the next n samples, as a read-only view valid until the next call
+    def read(self, n):
+        if n > self.max_block:
+            self._tile(n)  # only if the sound card asks for more than expected
+        block = self._table[self.pos:self.pos + n]
+        self.pos = (self.pos + n) % len(self.period)
+        return block
+
+
+# continuous sine at freq, exactly one whole number of cycles per period
+def tone(freq, fs, amp, max_block):
+    # freq / fs = cycles / samples in lowest terms, the shortest exactly repeating table
+    ratio = Fraction(freq / fs).limit_denominator(MAX_PERIOD)
+    samples = ratio.denominator
+    phase = 2 * np.pi * ratio.numerator * np.arange(samples) / samples
+    return Waveform(amp * np.sin(phase), max_block)
+
+
+# length seconds of sine at freq at the start of every interval seconds, silence in between
+def burst(freq, fs, amp, length, interval, max_block):
+    period = np.zeros(int(round(interval * fs)))
+    n = min(int(round(length * fs)), len(period))
+    signal = amp * np.sin(2 * np.pi * freq * np.arange(n) / fs)
+    ramp = min(int(RAMP * fs), n // 2)
+    if ramp > 0:
+        fade = 0.5 - 0.5 * np.cos(np.pi * np.arange(ramp) / ramp)
+        signal[:ramp] *= fade
+        signal[n - ramp:] *= fade[::-1]
+    period[:n] = signal
+    return Waveform(period, max_block)
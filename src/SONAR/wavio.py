@@ -0,0 +1,161 @@
+import json
+import os
+import struct
+from collections import namedtuple
+import numpy as np
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3  # what SONAR.record writes
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE  # the actual format tag is the start of the fmt chunk's subformat GUID
+
+# (format tag, sample width in bytes) -> (dtype, offset, scale) mapping to [-1, 1] floats
+SAMPLE_FORMATS = {
+    (WAVE_FORMAT_PCM, 1): (np.uint8, 128, 1 / 128),
+    (WAVE_FORMAT_PCM, 2): (np.int16, 0, 1 / 32768),
+    (WAVE_FORMAT_PCM, 4): (np.int32, 0, 1 / 2 ** 31),
+    (WAVE_FORMAT_IEEE_FLOAT, 4): (np.float32, 0, 1),
+}
+SPECTROGRAM_BATCH = 64  # windows transformed per rfft call by WavRecorder
+
+# where the samples of a WAV file are: frames of channels samples of sampwidth bytes at offset,
+# encoded as format, a WAVE_FORMAT_ tag
+WavInfo = namedtuple('WavInfo', ['fs', 'channels', 'sampwidth', 'offset', 'frames', 'format'])
+
+
+# walk the RIFF chunks of a WAV file up to its data chunk
+def read_wav_header(filename):
+    with open(filename, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError("%s is not a WAV file" % filename)
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError("%s has no data chunk" % filename)
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                body = f.read(size + (size & 1))
+                fmt = struct.unpack('<HHIIHH', body[:16])
+                if fmt[0] == WAVE_FORMAT_EXTENSIBLE and size >= 40:
+                    fmt = struct.unpack('<H', body[24:26]) + fmt[1:]
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError("%s has no fmt chunk before its data" % filename)
+                format_tag, channels, fs, _, block_align, bits = fmt
+                offset = f.tell()
+                # a recording that was cut short may not have its sizes patched, trust the file length
+                available = os.fstat(f.fileno()).st_size - offset
+                size = available if size == 0 else min(size, available)
+                return WavInfo(fs, channels, bits // 8, offset, size // block_align, format_tag)
+            else:  # chunks are padded to an even length
+                f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+# memory-map the samples of a WAV file as a read-only (frames, channels) array
+def open_wav(filename):
+    info = read_wav_header(filename)
+    if (info.format, info.sampwidth) not in SAMPLE_FORMATS:
+        raise ValueError("Unsupported WAV format %d with %d byte samples" % (info.format, info.sampwidth))
+    dtype = SAMPLE_FORMATS[info.format, info.sampwidth][0]
+    if info.frames == 0:  # np.memmap refuses empty maps
+        return info, np.zeros((0, info.channels), dtype = dtype)
+    return info, np.memmap(filename, dtype = dtype, mode = 'r', offset = info.offset,
+                           shape = (info.frames, info.channels))
+
+
+# samples of a file described by info as float32 in [-1, 1], float32 input is passed through
+def to_float32(samples, info):
+    dtype, offset, scale = SAMPLE_FORMATS[info.format, info.sampwidth]
+    if dtype == np.float32:
+        return samples
+    return ((samples.astype(np.float32) - offset) * scale).astype(np.float32)
+
+
+class WavRecorder:
+    ''' writes float32 mono audio to a WAV file as it arrives, memory stays bounded
+
+    the wave module can only label files as integer PCM, so the IEEE float
+    header is written here, its sizes filled in by close()
+
+    with spectrogram set to (chunk, low_ind, high_ind), every chunk samples
+    also give one column of band magnitudes; columns are computed
+    SPECTROGRAM_BATCH at a time and appended to filename.spec.f32 as raw
+    float32 rows, described by filename.spec.json '''
+    def __init__(self, filename, fs, spectrogram = None):
+        self.filename = filename
+        self.fs = fs
+        self.frames = 0  # samples written so far
+        self._wf = open(filename, 'wb')
+        # RIFF, fmt (with an empty extension, as non-PCM formats require), fact and data chunk headers;
+        # sizes and the fact frame count stay 0 until close()
+        self._wf.write(struct.pack('<4sI4s', b'RIFF', 0, b'WAVE'))
+        self._wf.write(struct.pack('<4sIHHIIHHH', b'fmt ', 18, WAVE_FORMAT_IEEE_FLOAT, 1, fs, 4 * fs, 4, 32, 0))
+        self._fact = self._wf.tell() + 8
+        self._wf.write(struct.pack('<4sII', b'fact', 4, 0))
+        self._wf.write(struct.pack('<4sI', b'data', 0))
+        self._data = self._wf.tell()
+
+        self._spec = None
+        if spectrogram is not None:
+            chunk, low_ind, high_ind = spectrogram
+            self._band = (low_ind, high_ind)
+            self._batch = np.zeros((SPECTROGRAM_BATCH, chunk), dtype = np.float32)
+            self._batch_fill = 0  # samples in the batch, rows fill left to right
+            self._columns = 0
+            self._spec = open(filename + '.spec.f32', 'wb')
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype = np.float32)
+        # the header sizes are left to close(), no seek per chunk
+        self._wf.write(samples.tobytes())
+        self.frames += len(samples)
+        if self._spec is not None:
+            self._add_to_batch(samples)
+
+    def _add_to_batch(self, samples):
+        flat = self._batch.reshape(-1)
+        while len(samples):
+            n = min(len(samples), len(flat) - self._batch_fill)
+            flat[self._batch_fill:self._batch_fill + n] = samples[:n]
+            self._batch_fill += n
+            samples = samples[n:]
+            if self._batch_fill == len(flat):
+                self._flush_batch()
+
+    def _flush_batch(self):
+        rows = self._batch_fill // self._batch.shape[1]  # a trailing partial window is dropped
+        if rows:
+            low_ind, high_ind = self._band
+            spectra = np.abs(np.fft.rfft(self._batch[:rows], axis = 1))[:, low_ind:high_ind]
+            self._spec.write(spectra.astype(np.float32).tobytes())
+            self._columns += rows
+        self._batch_fill = 0
+
+    def close(self):
+        size = 4 * self.frames  # always even, no padding byte
+        self._wf.seek(4)
+        self._wf.write(struct.pack('<I', self._data + size - 8))
+        self._wf.seek(self._fact)
+        self._wf.write(struct.pack('<I', self.frames))
+        self._wf.seek(self._data - 4)
+        self._wf.write(struct.pack('<I', size))
+        self._wf.close()
+        if self._spec is not None:
+            self._flush_batch()
+            self._spec.close()
+            low_ind, high_ind = self._band
+            meta = {'fs': self.fs, 'chunk': self._batch.shape[1], 'low_ind': low_ind,
+                    'high_ind': high_ind, 'columns': self._columns, 'dtype': 'float32'}
+            with open(self.filename + '.spec.json', 'w') as f:
+                json.dump(meta, f)
+
+
+# memory-map the sidecar spectrogram of a recording as a (columns, bins) array
+def load_spectrogram(filename):
+    with open(filename + '.spec.json') as f:
+        meta = json.load(f)
+    shape = (meta['columns'], meta['high_ind'] - meta['low_ind'])
+    if meta['columns'] == 0:
+        return meta, np.zeros(shape, dtype = np.float32)
+    return meta, np.memmap(filename + '.spec.f32', dtype = np.float32, mode = 'r', shape = shape)
@@ -0,0 +1,222 @@
+"""Headless throughput benchmark for the camera pipeline.
+
+Runs the same crop / infer / vote loop as `step_5_camera.detect_signs`, with
+frames from a video file or synthesized from SignLanguageMNIST samples, a
+stand-in SONAR and no window, then prints FPS, per-stage latency percentiles
+and the letters that were emitted.
+
+The model runs on every frame by default. Synthesized frames are static
+unless `--noise` is set, so with `--gate` most of them would be served from
+the inference cache; gated runs are labelled as such in the report.
+
+    python benchmark_camera.py [--video clip.mp4] [--model fp32|int8|raw] [--engine ort] [--gate]
+    python benchmark_camera.py --streams 8 [--batched]
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(path)
+sys.path.append("/".join(path.split('/')[:-2]))
+
+from engines import ENGINES, make_engine
+from inference_service import BatchingInferenceService
+from model_config import EMBEDDING_VARIANTS, ENGINE, INDEX_TO_LETTER, MODEL_PATHS, MODEL_VARIANT
+from src.metrics import METRICS
+from step_5_camera import CAMERA_ENGINE_OPTIONS, END_OF_STREAM, QUEUE_TIMEOUT, SequenceClassifier, run_pipeline
+
+FRAME_SIZE = (480, 640)  # height, width of synthesized frames
+FRAMES_PER_SIGN = 200  # frames each synthesized sign is held for, enough for the vote to settle
+
+
+class StillSonar:
+    """Stand-in SONAR that never reports movement."""
+
+    movement_flag = False
+
+    def is_moving(self) -> bool:
+        return False
+
+    def read_move_count(self) -> int:
+        return 0
+
+    def read_move_duration(self) -> float:
+        return 0.
+
+    def drain_events(self) -> list:
+        return []
+
+    def abort(self):
+        pass
+
+
+class SyntheticFrames:
+    """VideoCapture-like source showing SignLanguageMNIST samples as camera frames.
+
+    Each sample is scaled up to fill the center crop and held for
+    `frames_per_sign` frames; `letters` lists the true letter of each sign.
+    With `noise`, gaussian sensor noise of that standard deviation is added
+    to every frame, as a real camera would.
+    """
+
+    def __init__(self, csv_path: str='data/sign_mnist_test.csv', num_signs: int=20,
+                 frames_per_sign: int=FRAMES_PER_SIGN, seed: int=0, noise: float=0.):
+        from step_2_dataset import SignLanguageMNIST
+
+        dataset = SignLanguageMNIST(csv_path)
+        rng = np.random.default_rng(seed)
+        indices = rng.choice(len(dataset), num_signs, replace=False)
+        height, width = FRAME_SIZE
+        pad = (width - height) // 2
+
+        self.frames = []
+        self.letters = []
+        for i in indices:
+            sample = cv2.resize(np.ascontiguousarray(dataset._samples[i, :, :, 0]), (height, height))
+            frame = cv2.copyMakeBorder(sample, 0, 0, pad, width - height - pad, cv2.BORDER_REPLICATE)
+            self.frames.append(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+            self.letters.append(INDEX_TO_LETTER[int(dataset._labels[i, 0])])
+        self.frames_per_sign = frames_per_sign
+        self.noise = noise
+        self._noise = np.empty(FRAME_SIZE + (3,), dtype=np.int16)
+        self._count = 0
+
+    def read(self):
+        sign = self._count // self.frames_per_sign
+        if sign >= len(self.frames):
+            return False, None
+        self._count += 1
+        if not self.noise:
+            return True, self.frames[sign]
+        cv2.randn(self._noise, (0,) * 3, (self.noise,) * 3)
+        return True, cv2.add(self.frames[sign], self._noise, dtype=cv2.CV_8U)
+
+    def release(self):
+        pass
+
+
+def collect_letters(letters: list):
+    """Headless render stage: record each change of the voted letter."""
+    def render(sonar, results, stop, timers):
+        while not stop.is_set():
+            try:
+                item = results.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                continue
+            if item is END_OF_STREAM:
+                break
+            captured, frame, letter, frame_letter = item
+            start = time.perf_counter()
+            if letter is not None and (not letters or letters[-1] != letter):
+                letters.append(letter)
+            timers['render'].add(time.perf_counter() - start)
+            timers['latency'].add(time.monotonic() - captured)
+    return render
+
+
+def benchmark(cap, model: str=MODEL_VARIANT, gate: bool=False, engine: str=ENGINE):
+    """Run the pipeline over every frame of cap and print the statistics."""
+    runner = make_engine(engine, model, **CAMERA_ENGINE_OPTIONS.get(engine, {}))
+    letters = []
+
+    start = time.perf_counter()
+    sequence = SequenceClassifier() if model in EMBEDDING_VARIANTS else None
+    timers = run_pipeline(StillSonar(), runner, runner.raw_input, cap, collect_letters(letters),
+                          lossless=True, stats_window=None, gate=gate, sequence=sequence)
+    elapsed = time.perf_counter() - start
+
+    num_frames = len(timers['infer'].durations)
+    print('model %s on %s%s: %d frames in %.2f s, %.1f FPS' % (
+        model, engine, ', gated' if gate else '', num_frames, elapsed, num_frames / elapsed))
+    if gate:
+        print('inference skipped on %d frames (%.1f%%)' % (
+            timers['infer'].skipped, 100. * timers['infer'].skipped / max(num_frames, 1)))
+    print('%-8s %9s %9s %9s' % ('stage', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, timer in timers.items():
+        print('%-8s %9.3f %9.3f %9.3f' % ((name,) + tuple(timer.percentiles())))
+    print('letters:', ''.join(letters))
+    return letters
+
+
+def benchmark_streams(caps: list, model: str=MODEL_VARIANT, gate: bool=False, batched: bool=True,
+                      engine: str=ENGINE):
+    """Run one pipeline per capture at once, on a shared batching service or an engine each."""
+    service = BatchingInferenceService(make_engine(engine, model)) if batched else None
+    timers = [None] * len(caps)
+
+    def stream(i: int):
+        runner = service.client(i) if batched else make_engine(engine, model, **CAMERA_ENGINE_OPTIONS.get(engine, {}))
+        raw_input = service.engine.raw_input if batched else runner.raw_input
+        sequence = SequenceClassifier() if model in EMBEDDING_VARIANTS else None
+        try:
+            timers[i] = run_pipeline(StillSonar(), runner, raw_input, caps[i], collect_letters([]),
+                                     lossless=True, stats_window=None, gate=gate, sequence=sequence)
+        finally:
+            if batched:
+                runner.close()
+
+    threads = [threading.Thread(target=stream, args=(i,)) for i in range(len(caps))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if service is not None:
+        service.close()
+
+    num_frames = sum(len(t['infer'].durations) for t in timers)
+    print('model %s, %d streams %s%s: %d frames in %.2f s, %.1f FPS in total' % (
+        model, len(caps), 'batched' if batched else 'with an engine each', ', gated' if gate else '',
+        num_frames, elapsed, num_frames / elapsed))
+    if gate:
+        skipped = sum(t['infer'].skipped for t in timers)
+        print('inference skipped on %d frames (%.1f%%)' % (skipped, 100. * skipped / max(num_frames, 1)))
+    latency = np.concatenate([np.array(t['infer'].durations) for t in timers]) * 1000.
+    print('infer p50 %.3f ms, p99 %.3f ms' % tuple(np.percentile(latency, (50, 99))))
+    if batched:
+        sizes = METRICS.histogram('inference.batch_size').summary()
+        waits = METRICS.histogram('inference.queue_seconds').summary()
+        print('batch size mean %.1f, max %d; queue wait p50 %.3f ms, p99 %.3f ms' % (
+            sizes['mean'], sizes['max'], waits['p50'] * 1000., waits['p99'] * 1000.))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--video', help='video file to read frames from, default synthesizes frames')
+    parser.add_argument('--model', default=MODEL_VARIANT, choices=sorted(MODEL_PATHS))
+    parser.add_argument('--engine', default=ENGINE, choices=sorted(ENGINES), help='inference backend')
+    parser.add_argument('--signs', type=int, default=20, help='number of synthesized signs')
+    parser.add_argument('--noise', type=float, default=0., help='sensor noise added to synthesized frames')
+    parser.add_argument('--gate', action='store_true',
+                        help='reuse the results of unchanged frames like the camera does, reported separately')
+    parser.add_argument('--streams', type=int, default=1, help='synthesized camera streams run at once')
+    parser.add_argument('--batched', action='store_true',
+                        help='with --streams, share one batching inference service')
+    args = parser.parse_args()
+
+    if args.streams > 1:
+        caps = [SyntheticFrames(num_signs=args.signs, noise=args.noise, seed=i) for i in range(args.streams)]
+        benchmark_streams(caps, args.model, args.gate, args.batched, args.engine)
+        return
+
+    if args.video:
+        cap = cv2.VideoCapture(args.video)
+    else:
+        cap = SyntheticFrames(num_signs=args.signs, noise=args.noise)
+        print('expected:', ''.join(cap.letters))
+    try:
+        benchmark(cap, args.model, args.gate, args.engine)
+    finally:
+        cap.release()
+
+
+if __name__ == '__main__':
+    main()
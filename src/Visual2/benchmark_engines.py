@@ -0,0 +1,71 @@
+"""Compare the inference backends of engines.py on the same model.
+
+For every engine, prints the median single-frame latency the camera loop
+sees and the throughput of back-to-back batches the batching service sees.
+ONNX Runtime is also run without IO binding and with basic graph
+optimizations only, to show what each of those settings is worth.
+
+    python benchmark_engines.py [--variant fp32|int8|raw] [--threads 1] [--batch 64]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import onnxruntime as ort
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(path)
+
+from engines import ENGINES, LATENCY_RUNS, MAX_BATCH, OrtEngine, make_engine, measure_latency, \
+    measure_throughput, sample_input
+from model_config import MODEL_PATHS, MODEL_VARIANT
+
+# ONNX Runtime settings compared besides the defaults
+ORT_CONFIGS = {
+    'ort-no-binding': {'io_binding': False},
+    'ort-basic': {'optimization': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC},
+}
+
+
+def build_engines(names: list, variant: str, threads: int) -> dict:
+    """Construct each requested engine, reporting the ones that cannot run variant."""
+    engines = {}
+    for name in names:
+        try:
+            if name in ORT_CONFIGS:
+                engines[name] = OrtEngine(variant, threads, **ORT_CONFIGS[name])
+            else:
+                engines[name] = make_engine(name, variant, threads=threads)
+        except Exception as e:
+            print('%s: skipped, %s' % (name, e))
+    return engines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES) + list(ORT_CONFIGS),
+                        choices=list(ENGINES) + list(ORT_CONFIGS))
+    parser.add_argument('--variant', default=MODEL_VARIANT, choices=sorted(MODEL_PATHS))
+    parser.add_argument('--threads', type=int, default=None, help='intra-op threads, default every core')
+    parser.add_argument('--batch', type=int, default=MAX_BATCH, help='frames per call when measuring throughput')
+    parser.add_argument('--runs', type=int, default=LATENCY_RUNS, help='single-frame calls timed per engine')
+    args = parser.parse_args()
+
+    engines = build_engines(args.engines, args.variant, args.threads)
+    reference = None
+    print('%-16s %12s %14s %12s' % ('engine', 'latency ms', 'images/s', 'max diff'))
+    for name, engine in engines.items():
+        batch = args.batch if engine.max_batch is None else min(args.batch, engine.max_batch)
+        # every engine should agree with the first one on the same input
+        logits = np.array(engine(sample_input(engine, batch)))
+        if reference is None:
+            reference = logits
+        diff = np.max(np.abs(logits - reference[:len(logits)]))
+        latency = measure_latency(engine, args.runs)
+        throughput = measure_throughput(engine, batch)
+        print('%-16s %12.3f %14.0f %12.2e' % (name, latency, throughput, diff))
+
+
+if __name__ == '__main__':
+    main()
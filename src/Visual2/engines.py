@@ -0,0 +1,178 @@
+"""Interchangeable inference backends for the sign classifier.
+
+Every engine maps a (N, 1, 28, 28) batch to (N, 24) logits: float32 pixels
+normalized with MEAN / STD, or uint8 pixels when `raw_input` is set. For
+EMBEDDING_VARIANTS each row is followed by the frame's embedding. Engines
+also answer `run(None, {'input': x})` like an `ort.InferenceSession`, so the
+camera loop and the batching service can use any of them. Arrays returned by
+an engine may be reused by its next call, and an engine is not meant to be
+called from several threads at once.
+"""
+import time
+
+import numpy as np
+import onnxruntime as ort
+
+from model_config import CHECKPOINT_PATH, EMBEDDING_VARIANTS, MODEL_PATHS, MODEL_VARIANT, RAW_INPUT_VARIANTS
+
+MAX_BATCH = 64  # batch size preallocated for IO binding, larger batches fall back to plain runs
+LATENCY_RUNS = 1000  # single-image inferences timed per engine
+THROUGHPUT_SECONDS = 2.  # seconds of back-to-back batches timed per engine
+
+
+class InferenceEngine:
+    """Base class of the backends, see the module docstring."""
+
+    name = None
+    raw_input = False  # whether inputs are uint8 pixels rather than normalized floats
+    max_batch = None  # largest batch the model accepts, None for any
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def run(self, output_names, feed: dict) -> list:
+        x, = feed.values()
+        return [self(x)]
+
+
+class TorchEngine(InferenceEngine):
+    """Net from step_3_train run eagerly by PyTorch."""
+
+    name = 'torch'
+
+    def __init__(self, variant: str=MODEL_VARIANT, threads: int=None, checkpoint: str=CHECKPOINT_PATH):
+        # torch is only imported by the engines that need it, it is slow to load
+        import torch
+        from step_3_train import EmbeddingNet, Net
+
+        if variant != 'fp32' and variant not in EMBEDDING_VARIANTS:
+            raise ValueError('%s runs the PyTorch checkpoint, there is no %s variant' % (self.name, variant))
+        if threads:
+            torch.set_num_threads(threads)
+        self._torch = torch
+        net = Net().float().eval()
+        net.load_state_dict(torch.load(checkpoint))
+        if variant in EMBEDDING_VARIANTS:
+            net = EmbeddingNet(net).eval()
+        self.net = self.compile(net)
+
+    def compile(self, net):
+        return net
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        with self._torch.inference_mode():
+            return self.net(self._torch.from_numpy(x)).numpy()
+
+
+class TorchScriptEngine(TorchEngine):
+    """Net scripted and frozen, weights folded into the graph as constants."""
+
+    name = 'torchscript'
+
+    def compile(self, net):
+        return self._torch.jit.optimize_for_inference(self._torch.jit.freeze(self._torch.jit.script(net)))
+
+
+class OrtEngine(InferenceEngine):
+    """ONNX Runtime with explicit session options and preallocated output binding."""
+
+    name = 'ort'
+
+    def __init__(self, variant: str=MODEL_VARIANT, threads: int=None,
+                 optimization: ort.GraphOptimizationLevel=ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+                 io_binding: bool=True, max_batch: int=MAX_BATCH):
+        """
+        Args:
+            variant: Exported model, one of MODEL_PATHS
+            threads: Intra-op threads, None lets ONNX Runtime use every core
+            optimization: Graph optimization level
+            io_binding: Write logits into a preallocated buffer instead of a new array per call
+            max_batch: Largest batch the output buffer holds
+        """
+        options = ort.SessionOptions()
+        options.graph_optimization_level = optimization
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(MODEL_PATHS[variant], options, providers=['CPUExecutionProvider'])
+        self.raw_input = variant in RAW_INPUT_VARIANTS
+
+        model_input = self.session.get_inputs()[0]
+        model_output = self.session.get_outputs()[0]
+        self.input_name = model_input.name
+        self.output_name = model_output.name
+        if isinstance(model_input.shape[0], int):  # exported with a fixed batch size
+            self.max_batch = max_batch = model_input.shape[0]
+        self._binding = None
+        if io_binding:
+            self._binding = self.session.io_binding()
+            self._outputs = np.empty((max_batch, model_output.shape[1]), dtype=np.float32)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        n = len(x)
+        if self._binding is None or n > len(self._outputs):
+            return self.session.run(None, {self.input_name: x})[0]
+        self._binding.bind_cpu_input(self.input_name, np.ascontiguousarray(x))
+        self._binding.bind_output(self.output_name, 'cpu', 0, np.float32, [n, self._outputs.shape[1]],
+                                  self._outputs.ctypes.data)
+        self.session.run_with_iobinding(self._binding)
+        return self._outputs[:n]
+
+
+class OpenCVEngine(InferenceEngine):
+    """The exported ONNX model run by OpenCV's DNN module."""
+
+    name = 'opencv'
+
+    def __init__(self, variant: str=MODEL_VARIANT, threads: int=None):
+        import cv2
+
+        if threads:
+            cv2.setNumThreads(threads)  # process-wide in OpenCV
+        self.net = cv2.dnn.readNetFromONNX(MODEL_PATHS[variant])
+        self.raw_input = variant in RAW_INPUT_VARIANTS
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        self.net.setInput(x)
+        return self.net.forward()
+
+
+ENGINES = {engine.name: engine for engine in (TorchEngine, TorchScriptEngine, OrtEngine, OpenCVEngine)}
+
+
+def make_engine(name: str, variant: str=MODEL_VARIANT, **kwargs) -> InferenceEngine:
+    """Create the engine registered under name, see ENGINES."""
+    return ENGINES[name](variant, **kwargs)
+
+
+def sample_input(engine: InferenceEngine, batch: int=1) -> np.ndarray:
+    """Random input of the right type for engine."""
+    rng = np.random.default_rng(0)
+    if engine.raw_input:
+        return rng.integers(0, 256, (batch, 1, 28, 28), dtype=np.uint8)
+    return rng.standard_normal((batch, 1, 28, 28), dtype=np.float32)
+
+
+def measure_latency(engine, runs: int=LATENCY_RUNS) -> float:
+    """Median single-image inference time in milliseconds."""
+    x = sample_input(engine)
+    engine(x)  # warm up
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        engine(x)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000.
+
+
+def measure_throughput(engine, batch: int=MAX_BATCH, seconds: float=THROUGHPUT_SECONDS) -> float:
+    """Images per second classified in back-to-back batches."""
+    x = sample_input(engine, batch)
+    engine(x)  # warm up
+    images = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        engine(x)
+        images += batch
+    return images / (time.perf_counter() - start)
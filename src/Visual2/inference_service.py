@@ -0,0 +1,231 @@
+"""Shared inference for several camera streams.
+
+One inference engine (see engines.py) serves every stream: concurrent
+single-frame requests are coalesced into micro-batches of up to `max_batch`
+frames, waiting at most `max_wait` seconds after the first one. Clients look
+like an `ort.InferenceSession` to `recognize_frames`, either in-process
+(`BatchingInferenceService.client`) or over a loopback socket
+(`serve_socket` / `SocketClient`).
+"""
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("/".join(path.split('/')[:-2]))
+
+from src.metrics import METRICS
+
+MAX_BATCH = 32  # most frames per model call
+MAX_WAIT = 0.002  # seconds the first frame of a batch waits for company
+INPUT_SHAPE = (1, 28, 28)  # one frame, without the batch axis
+
+
+class _Request:
+    __slots__ = ('stream', 'x', 'enqueued', 'future')
+
+    def __init__(self, stream, x: np.ndarray):
+        self.stream = stream
+        self.x = x
+        self.enqueued = time.monotonic()
+        self.future = Future()
+
+
+class BatchingInferenceService:
+    """Run one engine for many streams, batching requests that arrive together."""
+
+    def __init__(self, engine, max_batch: int=MAX_BATCH, max_wait: float=MAX_WAIT):
+        """
+        Args:
+            engine: InferenceEngine, ideally of a model with a dynamic batch axis
+            max_batch: Most frames per model call
+            max_wait: Seconds a request may wait for others before its batch runs
+        """
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        if engine.max_batch is not None:
+            # exported with a fixed batch size, frames still share the engine
+            self.max_batch = max_batch = min(max_batch, engine.max_batch)
+        dtype = np.uint8 if engine.raw_input else np.float32
+        self._inputs = np.empty((max_batch,) + INPUT_SHAPE, dtype=dtype)
+        self._requests = queue.Queue()
+        self.streams = 0  # connected clients, a batch never waits for more frames than this
+        self._streams_lock = threading.Lock()
+        self._batch_size = METRICS.histogram('inference.batch_size')
+        self._queue_time = METRICS.histogram('inference.queue_seconds')
+        self._run_time = METRICS.histogram('inference.run_seconds')
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def input_dtype(self):
+        return self._inputs.dtype
+
+    def submit(self, x: np.ndarray, stream=None) -> Future:
+        """Queue one (1, 1, 28, 28) frame, the future resolves to its (1, classes) logits."""
+        request = _Request(stream, x)
+        self._requests.put(request)
+        return request.future
+
+    def infer(self, x: np.ndarray, stream=None) -> np.ndarray:
+        return self.submit(x, stream).result()
+
+    def client(self, stream=None) -> 'ServiceClient':
+        """Handle for one stream, close it when the stream ends."""
+        self.connect()
+        return ServiceClient(self, stream)
+
+    def connect(self):
+        with self._streams_lock:
+            self.streams += 1
+
+    def disconnect(self):
+        with self._streams_lock:
+            self.streams -= 1
+
+    def close(self):
+        """Finish the queued requests and stop the batching thread."""
+        self._requests.put(None)
+        self._thread.join()
+
+    def _serve(self):
+        while True:
+            first = self._requests.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = first.enqueued + self.max_wait
+            closing = False
+            # each stream has at most one frame in flight, waiting for more would only add latency
+            streams = self.streams
+            limit = min(self.max_batch, streams) if streams else self.max_batch
+            while len(batch) < limit:
+                timeout = deadline - time.monotonic()
+                try:
+                    # past the deadline only take what is already queued
+                    request = self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                batch.append(request)
+            self._run(batch)
+            if closing:
+                return
+
+    def _run(self, batch: list):
+        start = time.monotonic()
+        for i, request in enumerate(batch):
+            self._inputs[i] = request.x[0]
+            self._queue_time.observe(start - request.enqueued)
+        self._batch_size.observe(len(batch))
+        METRICS.incr('inference.requests', len(batch))
+
+        try:
+            logits = self.engine(self._inputs[:len(batch)])
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        self._run_time.observe(time.monotonic() - start)
+        # the engine may reuse its output buffer for the next batch
+        for i, request in enumerate(batch):
+            request.future.set_result(logits[i:i + 1].copy())
+
+
+class ServiceClient:
+    """One stream's handle on a BatchingInferenceService, used like an ort.InferenceSession."""
+
+    def __init__(self, service: BatchingInferenceService, stream=None):
+        self.service = service
+        self.stream = stream
+        self.closed = False
+
+    def run(self, output_names, feed: dict) -> list:
+        x, = feed.values()
+        return [self.service.infer(x, self.stream)]
+
+    def close(self):
+        """Stop counting this stream, so batches no longer wait for its frames."""
+        if not self.closed:
+            self.closed = True
+            self.service.disconnect()
+
+
+def serve_socket(service: BatchingInferenceService, port: int, host: str='127.0.0.1') -> socket.socket:
+    """Accept streams over TCP, each connection being one stream.
+
+    A client sends frames as the raw bytes of the model's (1, 1, 28, 28)
+    input and reads back each frame's logits as float32. Returns the
+    listening socket, close it to stop accepting.
+    """
+    listener = socket.create_server((host, port))
+    frame_bytes = int(np.prod(INPUT_SHAPE)) * service.input_dtype.itemsize
+
+    def handle(conn: socket.socket, stream):
+        service.connect()
+        try:
+            with conn:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                while True:
+                    data = _recv_exactly(conn, frame_bytes)
+                    if data is None:
+                        return
+                    x = np.frombuffer(data, dtype=service.input_dtype).reshape((1,) + INPUT_SHAPE)
+                    conn.sendall(service.infer(x, stream).astype(np.float32).tobytes())
+        except OSError:  # client went away mid-frame
+            pass
+        finally:
+            service.disconnect()
+
+    def accept():
+        while True:
+            try:
+                conn, address = listener.accept()
+            except OSError:  # listener closed
+                return
+            threading.Thread(target=handle, args=(conn, address), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener
+
+
+class SocketClient:
+    """Stream talking to `serve_socket`, used like an ort.InferenceSession."""
+
+    def __init__(self, port: int, num_classes: int, host: str='127.0.0.1'):
+        self.num_classes = num_classes
+        self._conn = socket.create_connection((host, port))
+        self._conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def run(self, output_names, feed: dict) -> list:
+        x, = feed.values()
+        self._conn.sendall(np.ascontiguousarray(x).tobytes())
+        data = _recv_exactly(self._conn, self.num_classes * 4)
+        if data is None:
+            raise ConnectionError('inference service closed the connection')
+        return [np.frombuffer(data, dtype=np.float32).reshape(1, self.num_classes).copy()]
+
+    def close(self):
+        self._conn.close()
+
+
+def _recv_exactly(conn: socket.socket, size: int):
+    """Read exactly size bytes, or return None if the peer closed first."""
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        n = conn.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return data
@@ -0,0 +1,36 @@
+"""Exported model files and constants shared by evaluation and the camera loop."""
+import os
+
+path = os.path.dirname(os.path.realpath(__file__))
+
+CHECKPOINT_PATH = os.path.join(path, 'checkpoint.pth')  # trained weights of step_3_train.Net
+
+# ONNX variants written by step_4_evaluate.validate
+# 'raw' takes uint8 pixels and has normalization and LETTER_BIAS built in
+MODEL_PATHS = {
+    'fp32': os.path.join(path, 'signlanguage.onnx'),
+    'int8': os.path.join(path, 'signlanguage.int8.onnx'),
+    'raw': os.path.join(path, 'signlanguage.raw.onnx'),
+    'embed': os.path.join(path, 'signlanguage.embed.onnx'),
+}
+MODEL_VARIANT = 'fp32'  # model used by the camera loop, one of MODEL_PATHS
+ENGINE = 'ort'  # inference backend used by the camera loop, one of engines.ENGINES
+RAW_INPUT_VARIANTS = ('raw',)  # variants fed uint8 pixels instead of normalized floats
+# variants whose output is each frame's logits followed by its embedding, enabling the sequence head
+EMBEDDING_VARIANTS = ('embed',)
+
+# sequence head over the embeddings of recent frames, for the letters that are motions
+SEQUENCE_CHECKPOINT_PATH = os.path.join(path, 'sequence_head.pth')  # trained step_3_train.SequenceHead
+SEQUENCE_HEAD_PATH = os.path.join(path, 'signlanguage.head.onnx')
+SEQUENCE_CLASSES = (None, 'J', 'Z')  # head outputs, None for no dynamic letter
+SEQUENCE_LENGTH = 24  # frames in the head's window
+EMBEDDING_SIZE = 48  # per-frame features the head reads
+
+INDEX_TO_LETTER = 'ABCDEFGHIKLMNOPQRSTUVWXY'
+
+# pixel normalization the model was trained with
+MEAN = 0.485 * 255.
+STD = 0.229 * 255.
+
+# logit adjustments for the camera: artificially bias towards 'I', decrease 'P'
+LETTER_BIAS = {'I': 10., 'P': -10.}
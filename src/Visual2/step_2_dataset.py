@@ -1,13 +1,27 @@
 from torch.utils.data import Dataset
-from torch.autograd import Variable
 import torchvision.transforms as transforms
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
 import torch
 
-from typing import List
+from typing import List, Tuple
 
 import csv
+import hashlib
+import json
+import math
+import os
+
+from model_config import INDEX_TO_LETTER, SEQUENCE_CLASSES, SEQUENCE_LENGTH
+
+CACHE_DIR = '.cache'  # binary copies of the CSVs, next to the CSVs
+CACHE_VERSION = 1  # bump to invalidate caches written by older code
+SEQUENCE_CLIPS = 20000  # synthesized clips in one epoch of SignSequences
+# static handshape each dynamic letter is traced with, Z is drawn with the index finger like D
+TRACED_WITH = {'J': 'I', 'Z': 'D'}
+JITTER = 0.02  # per-frame hand shake, in normalized image coordinates
+PREFETCH_FACTOR = 4  # batches each loader worker keeps ready
 
 
 class SignLanguageMNIST(Dataset):
@@ -46,25 +60,94 @@ class SignLanguageMNIST(Dataset):
                 samples.append(list(map(int, line[1:])))
         return labels, samples
 
+    @staticmethod
+    def file_digest(path: str) -> str:
+        """sha256 of a file, read in 1 MiB blocks."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _write_json(path: str, data: dict):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def load_label_samples(path: str):
+        """
+        Load labels and samples through a binary cache next to the CSV.
+
+        The CSV is parsed once into uint8 `.npy` files keyed by its sha256.
+        Later loads memory-map the samples, and the CSV is only re-read when
+        its contents change. Size and mtime are checked first, so an
+        untouched CSV is not even hashed.
+        """
+        cache_dir = os.path.join(os.path.dirname(path), CACHE_DIR)
+        stem = os.path.join(cache_dir, os.path.splitext(os.path.basename(path))[0])
+        labels_path, samples_path = stem + '.labels.npy', stem + '.samples.npy'
+        meta_path = stem + '.meta.json'
+
+        stat = os.stat(path)
+        expected = {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        meta = {}
+        if os.path.exists(meta_path) and os.path.exists(labels_path) and os.path.exists(samples_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+        if meta.get('version') != CACHE_VERSION:
+            meta = {}
+        if meta and any(meta.get(key) != value for key, value in expected.items()):
+            # touched or copied, only rebuild if the contents really changed
+            if meta.get('sha256') != SignLanguageMNIST.file_digest(path):
+                meta = {}
+            else:
+                meta.update(expected)
+                SignLanguageMNIST._write_json(meta_path, meta)
+
+        if not meta:
+            labels, samples = SignLanguageMNIST.read_label_samples_from_csv(path)
+            os.makedirs(cache_dir, exist_ok=True)
+            for array, dest in (
+                    (np.array(labels, dtype=np.uint8).reshape((-1, 1)), labels_path),
+                    (np.array(samples, dtype=np.uint8).reshape((-1, 28, 28, 1)), samples_path)):
+                # write under a temporary name so an interrupted run leaves no half cache
+                np.save(dest + '.tmp.npy', array)
+                os.replace(dest + '.tmp.npy', dest)
+            meta = dict(expected, sha256=SignLanguageMNIST.file_digest(path))
+            SignLanguageMNIST._write_json(meta_path, meta)
+
+        return np.load(labels_path), np.load(samples_path, mmap_mode='r')
+
     def __init__(self,
             path: str="data/sign_mnist_train.csv",
             mean: List[float]=[0.485],
-            std: List[float]=[0.229]):
+            std: List[float]=[0.229],
+            batched: bool=False):
         """
         Args:
             path: Path to `.csv` file containing `label`, `pixel0`, `pixel1`...
+            batched: Index with lists of indices and return raw uint8 batches,
+                to be augmented on the whole batch by `BatchAugment`
         """
-        labels, samples = SignLanguageMNIST.read_label_samples_from_csv(path)
-        self._samples = np.array(samples, dtype=np.uint8).reshape((-1, 28, 28, 1))
-        self._labels = np.array(labels, dtype=np.uint8).reshape((-1, 1))
+        self._labels, self._samples = SignLanguageMNIST.load_label_samples(path)
 
         self._mean = mean
         self._std = std
+        self._batched = batched
 
     def __len__(self):
         return len(self._labels)
 
     def __getitem__(self, idx):
+        if self._batched:
+            return {
+                'image': torch.from_numpy(self._samples[idx]).permute(0, 3, 1, 2),
+                'label': torch.from_numpy(self._labels[idx]).float()
+            }
+
         transform = transforms.Compose([
             transforms.ToPILImage(),
             transforms.RandomResizedCrop(28, scale=(0.8, 1.2)),
@@ -77,12 +160,199 @@ class SignLanguageMNIST(Dataset):
         }
 
 
-def get_train_test_loaders(batch_size=32):
+class BatchAugment:
+    """Random resized crop and normalization for a whole uint8 batch at once.
+
+    Tensor counterpart of the per-sample `RandomResizedCrop(28, scale=(0.8, 1.2))`
+    and `Normalize` in `SignLanguageMNIST.__getitem__`: each image gets its own
+    random crop through one batched affine grid, crops larger than the image
+    are clamped to its borders instead of being resampled.
+    """
+
+    def __init__(self,
+            size: int=28,
+            scale: Tuple[float, float]=(0.8, 1.2),
+            ratio: Tuple[float, float]=(3. / 4., 4. / 3.),
+            mean: List[float]=[0.485],
+            std: List[float]=[0.229]):
+        self.size = size
+        self.scale = scale
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        # ToTensor's 1/255 and Normalize folded into a single multiply-add
+        std = torch.tensor(std).view(1, -1, 1, 1)
+        self._mul = 1. / (255. * std)
+        self._add = -torch.tensor(mean).view(1, -1, 1, 1) / std
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        """Augment an N x C x H x W uint8 batch into normalized floats."""
+        n = images.shape[0]
+        area = torch.empty(n).uniform_(*self.scale)
+        ratio = torch.exp(torch.empty(n).uniform_(*self.log_ratio))
+        # crop width and height as fractions of the image, centers anywhere the crop fits
+        w = torch.sqrt(area * ratio).clamp(max=1.)
+        h = torch.sqrt(area / ratio).clamp(max=1.)
+        theta = torch.zeros(n, 2, 3)
+        theta[:, 0, 0] = w
+        theta[:, 1, 1] = h
+        theta[:, 0, 2] = (torch.rand(n) * 2 - 1) * (1 - w)
+        theta[:, 1, 2] = (torch.rand(n) * 2 - 1) * (1 - h)
+
+        grid = F.affine_grid(theta, [n, images.shape[1], self.size, self.size], align_corners=False)
+        out = F.grid_sample(images.float(), grid, mode='bilinear', padding_mode='border', align_corners=False)
+        return torch.addcmul(self._add, out, self._mul)
+
+
+class SignSequences(Dataset):
+    """Synthesized clips of SignLanguageMNIST hands moving, for the sequence head.
+
+    J and Z are motions, the dataset has neither. A clip shows one training
+    image for `length` frames, each warped by an affine transform: for J the
+    I handshape goes down and hooks while the wrist turns, for Z the D
+    handshape traces a zigzag, and otherwise any handshape holds still or
+    drifts along a straight line, so that motion alone does not make a
+    letter. The motion takes half to all of the clip, at a random offset,
+    size and handedness.
+
+    Each sample is T x 1 x 28 x 28 normalized frames, and each label an index
+    into SEQUENCE_CLASSES.
+    """
+
+    def __init__(self,
+            path: str="data/sign_mnist_train.csv",
+            length: int=SEQUENCE_LENGTH,
+            num_clips: int=SEQUENCE_CLIPS,
+            seed: int=None,
+            mean: List[float]=[0.485],
+            std: List[float]=[0.229]):
+        """
+        Args:
+            path: Path to `.csv` file of SignLanguageMNIST
+            length: Frames per clip
+            num_clips: Clips per epoch, each synthesized when indexed
+            seed: Make every clip the same on every epoch, for evaluation
+        """
+        labels, self._samples = SignLanguageMNIST.load_label_samples(path)
+        self._by_letter = {letter: np.flatnonzero(labels[:, 0] == i) for i, letter in enumerate(INDEX_TO_LETTER)}
+        self.length = length
+        self.num_clips = num_clips
+        self.seed = seed
+        self._mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self._std = torch.tensor(std).view(1, -1, 1, 1)
+        # half of the clips show no dynamic letter
+        dynamic = len(SEQUENCE_CLASSES) - 1
+        self._class_p = [0.5 if letter is None else 0.5 / dynamic for letter in SEQUENCE_CLASSES]
+
+    def __len__(self):
+        return self.num_clips
+
+    @staticmethod
+    def trace(letter: str, t: np.ndarray, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        """Hand position in [-1, 1]^2 and wrist angle at times t in [0, 1]."""
+        if letter == 'J':
+            # down, then curl back up to the side over the last 40%
+            down = np.clip(t / 0.6, 0, 1)
+            curl = np.clip((t - 0.6) / 0.4, 0, 1) * np.pi
+            xy = np.stack([-0.5 + 0.5 * np.cos(curl), np.where(t < 0.6, 2 * down - 1, 1 + 0.5 * np.sin(curl))], 1)
+            return xy, np.clip((t - 0.4) / 0.6, 0, 1) * np.pi / 2
+        if letter == 'Z':
+            corners = np.array([[-1., -1.], [1., -1.], [-1., 1.], [1., 1.]])
+            segment = np.minimum((t * 3).astype(int), 2)
+            frac = (t * 3 - segment)[:, None]
+            return corners[segment] * (1 - frac) + corners[segment + 1] * frac, np.zeros(len(t))
+        # no dynamic letter, held still or drifting
+        if rng.random() < 0.5:
+            return np.zeros((len(t), 2)), np.zeros(len(t))
+        start, end = rng.uniform(-1, 1, (2, 2))
+        return start + (end - start) * t[:, None], np.zeros(len(t))
+
+    def __getitem__(self, idx):
+        rng = np.random.default_rng(None if self.seed is None else (self.seed, idx))
+        label = rng.choice(len(SEQUENCE_CLASSES), p=self._class_p)
+        letter = SEQUENCE_CLASSES[label]
+        if letter is None:
+            sample = rng.integers(len(self._samples))
+        else:
+            sample = rng.choice(self._by_letter[TRACED_WITH[letter]])
+
+        # the motion spans frames offset .. offset + duration - 1, held at its ends around it
+        duration = rng.integers(self.length // 2, self.length + 1)
+        offset = rng.integers(0, self.length - duration + 1)
+        t = np.clip((np.arange(self.length) - offset) / max(duration - 1, 1), 0, 1)
+        xy, angle = self.trace(letter, t, rng)
+        mirror = rng.choice([-1., 1.])
+        xy = xy * rng.uniform(0.2, 0.4) * [mirror, 1.] + rng.normal(0, JITTER, xy.shape)
+        angle = angle * mirror
+        zoom = rng.uniform(0.8, 1.2)
+
+        # affine_grid maps output to input coordinates: undo the shift, then the rotation
+        cos, sin = np.cos(angle) / zoom, np.sin(angle) / zoom
+        theta = np.empty((self.length, 2, 3))
+        theta[:, 0, 0], theta[:, 0, 1] = cos, sin
+        theta[:, 1, 0], theta[:, 1, 1] = -sin, cos
+        theta[:, :, 2] = -np.einsum('nij,nj->ni', theta[:, :, :2], xy)
+
+        image = torch.from_numpy(np.array(self._samples[sample])).permute(2, 0, 1)[None].float()
+        grid = F.affine_grid(torch.from_numpy(theta).float(), [self.length, 1, 28, 28], align_corners=False)
+        frames = F.grid_sample(image.expand(self.length, -1, -1, -1), grid, mode='bilinear',
+                               padding_mode='border', align_corners=False)
+        return {
+            'frames': (frames / 255. - self._mean) / self._std,
+            'label': torch.tensor(label)
+        }
+
+
+def loader_options(num_workers: int=0, prefetch_factor: int=PREFETCH_FACTOR) -> dict:
+    """DataLoader arguments for `num_workers` loading processes.
+
+    Workers persist across epochs, so they and their memory-mapped samples
+    are set up once, and each keeps `prefetch_factor` batches ready.
+    """
+    if num_workers <= 0:
+        return {}
+    return {'num_workers': num_workers, 'persistent_workers': True, 'prefetch_factor': prefetch_factor}
+
+
+class AugmentedBatches:
+    """Loader `collate_fn` applying `augment` to each batch's images, in the loader workers if any."""
+
+    def __init__(self, augment: BatchAugment):
+        self.augment = augment
+
+    def __call__(self, batch: dict) -> dict:
+        return dict(batch, image=self.augment(batch['image']))
+
+
+def get_train_test_loaders(batch_size=32, batch_augment=False, num_workers=0, augment=None):
+    """
+    With `batch_augment`, both loaders yield raw uint8 batches sliced straight
+    from the dataset, to be augmented with `BatchAugment`; given `augment`,
+    the training loader applies it itself, so that with workers it runs in
+    them. With `num_workers`, batches are loaded by that many background
+    processes, see loader_options.
+    """
+    options = loader_options(num_workers)
+    if batch_augment:
+        trainset = SignLanguageMNIST('data/sign_mnist_train.csv', batched=True)
+        sampler = torch.utils.data.BatchSampler(
+            torch.utils.data.RandomSampler(trainset), batch_size, drop_last=False)
+        if augment is not None:
+            # with batch_size None, collate_fn is applied to each batch the sampler yields
+            options_train = dict(options, collate_fn=AugmentedBatches(augment))
+        else:
+            options_train = options
+        trainloader = torch.utils.data.DataLoader(trainset, batch_size=None, sampler=sampler, **options_train)
+
+        testset = SignLanguageMNIST('data/sign_mnist_test.csv', batched=True)
+        sampler = torch.utils.data.BatchSampler(
+            torch.utils.data.SequentialSampler(testset), batch_size, drop_last=False)
+        testloader = torch.utils.data.DataLoader(testset, batch_size=None, sampler=sampler, **options)
+        return trainloader, testloader
+
     trainset = SignLanguageMNIST('data/sign_mnist_train.csv')
-    trainloader = torch.utils.data.DataLoader(trainset, batch_size=batch_size, shuffle=True)
+    trainloader = torch.utils.data.DataLoader(trainset, batch_size=batch_size, shuffle=True, **options)
 
     testset = SignLanguageMNIST('data/sign_mnist_test.csv')
-    testloader = torch.utils.data.DataLoader(testset, batch_size=batch_size, shuffle=False)
+    testloader = torch.utils.data.DataLoader(testset, batch_size=batch_size, shuffle=False, **options)
     return trainloader, testloader
 
 
@@ -1,14 +1,32 @@
 from torch.utils.data import Dataset
-from torch.autograd import Variable
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 import torch
 
-from step_2_dataset import get_train_test_loaders
+import argparse
+import os
+import time
+
+from model_config import CHECKPOINT_PATH, EMBEDDING_SIZE, SEQUENCE_CHECKPOINT_PATH, SEQUENCE_CLASSES
+from step_2_dataset import BatchAugment, SignSequences, get_train_test_loaders, loader_options
+
+path = os.path.dirname(os.path.realpath(__file__))
+
+EPOCHS = 12  # passes over the training set
+BATCH_SIZE = 32  # images per update
+# background processes loading and augmenting batches, torch trains on the cores they leave
+LOADER_WORKERS = (os.cpu_count() or 1) - 1
+# model, optimizer, scheduler and epoch, written after every epoch so training can resume
+TRAINING_STATE_PATH = os.path.join(path, 'training_state.pth')
+LOG_INTERVAL = 100  # batches between loss and throughput reports
+SEQUENCE_EPOCHS = 10  # passes over freshly synthesized clips when training the sequence head
+SEQUENCE_BATCH_SIZE = 32  # clips per sequence head update
 
 
 class Net(nn.Module):
+    """Per-frame letter classifier, split into an embedding trunk and a linear classifier."""
+
     def __init__(self):
         super(Net, self).__init__()
         self.conv1 = nn.Conv2d(1, 6, 3)
@@ -16,38 +34,134 @@ class Net(nn.Module):
         self.conv2 = nn.Conv2d(6, 6, 3)
         self.conv3 = nn.Conv2d(6, 16, 3)
         self.fc1 = nn.Linear(16 * 5 * 5, 120)
-        self.fc2 = nn.Linear(120, 48)
-        self.fc3 = nn.Linear(48, 24)
+        self.fc2 = nn.Linear(120, EMBEDDING_SIZE)
+        self.fc3 = nn.Linear(EMBEDDING_SIZE, 24)
 
-    def forward(self, x):
+    def embed(self, x):
+        """N x 1 x 28 x 28 images to N x EMBEDDING_SIZE features, shared with the sequence head."""
         x = F.relu(self.conv1(x))
         x = self.pool(F.relu(self.conv2(x)))
         x = self.pool(F.relu(self.conv3(x)))
         x = x.view(-1, 16 * 5 * 5)
         x = F.relu(self.fc1(x))
         x = F.relu(self.fc2(x))
-        x = self.fc3(x)
         return x
 
+    def classify(self, x):
+        """Embeddings to letter logits."""
+        return self.fc3(x)
+
+    def forward(self, x):
+        return self.classify(self.embed(x))
+
+
+class EmbeddingNet(nn.Module):
+    """Net returning each image's letter logits followed by its embedding.
 
-def main():
+    One trunk pass gives both, so the camera loop can feed the sequence head
+    without running the model twice.
+    """
+
+    def __init__(self, net: Net):
+        super(EmbeddingNet, self).__init__()
+        self.net = net
+
+    def forward(self, x):
+        x = self.net.embed(x)
+        return torch.cat([self.net.classify(x), x], 1)
+
+
+class SequenceHead(nn.Module):
+    """Classify the embeddings of the last frames as one of SEQUENCE_CLASSES.
+
+    Takes N x T x EMBEDDING_SIZE. Two temporal convolutions see about 13
+    frames of motion, max pooling over time finds it anywhere in the window.
+    """
+
+    def __init__(self, embedding_size: int=EMBEDDING_SIZE, num_classes: int=len(SEQUENCE_CLASSES)):
+        super(SequenceHead, self).__init__()
+        self.conv1 = nn.Conv1d(embedding_size, 32, 5, padding=2)
+        self.pool = nn.MaxPool1d(2, 2)
+        self.conv2 = nn.Conv1d(32, 32, 5, padding=2)
+        self.fc = nn.Linear(32, num_classes)
+
+    def forward(self, x):
+        x = x.transpose(1, 2)
+        x = self.pool(F.relu(self.conv1(x)))
+        x = F.relu(self.conv2(x))
+        x = torch.amax(x, 2)
+        return self.fc(x)
+
+
+def save_training_state(state_path: str, epoch: int, net, optimizer, scheduler):
+    """Write everything needed to resume after `epoch`, replacing the previous state atomically."""
+    state = {
+        'epoch': epoch,
+        'model': net.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'scheduler': scheduler.state_dict(),
+    }
+    # write under a temporary name so an interrupted save keeps the previous epoch
+    torch.save(state, state_path + '.tmp')
+    os.replace(state_path + '.tmp', state_path)
+
+
+def load_training_state(state_path: str, net, optimizer, scheduler) -> int:
+    """Restore a state saved by save_training_state, returning the first epoch still to run."""
+    state = torch.load(state_path)
+    net.load_state_dict(state['model'])
+    optimizer.load_state_dict(state['optimizer'])
+    scheduler.load_state_dict(state['scheduler'])
+    return state['epoch'] + 1
+
+
+def training_threads(threads: int, num_workers: int) -> int:
+    """Threads torch trains with: `threads` if given, else the cores the loader workers leave free."""
+    return threads or max((os.cpu_count() or 1) - num_workers, 1)
+
+
+def main(epochs: int=EPOCHS, batch_size: int=BATCH_SIZE, num_workers: int=LOADER_WORKERS,
+         threads: int=None, resume: bool=False, state_path: str=TRAINING_STATE_PATH):
+    """Train Net from scratch, or from the last saved epoch with `resume`.
+
+    Args:
+        threads: Threads torch computes with, None for the cores not taken by loader workers
+    """
+    torch.set_num_threads(training_threads(threads, num_workers))
     net = Net().float()
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.SGD(net.parameters(), lr=0.01, momentum=0.9)
     scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=10, gamma=0.1)
 
-    trainloader, _ = get_train_test_loaders()
-    for epoch in range(12):  # loop over the dataset multiple times
-        train(net, criterion, optimizer, trainloader, epoch)
+    first_epoch = 0
+    if resume and os.path.exists(state_path):
+        first_epoch = load_training_state(state_path, net, optimizer, scheduler)
+        print('resuming at epoch %d from %s' % (first_epoch, state_path))
+
+    # batches arrive augmented, by the loader workers when there are any
+    trainloader, _ = get_train_test_loaders(batch_size, batch_augment=True, num_workers=num_workers,
+                                            augment=BatchAugment())
+    for epoch in range(first_epoch, epochs):  # loop over the dataset multiple times
+        start = time.perf_counter()
+        loss, samples = train(net, criterion, optimizer, trainloader, epoch)
         scheduler.step()
-    torch.save(net.state_dict(), "checkpoint.pth")
+        elapsed = time.perf_counter() - start
+        print('epoch %d: loss %.6f, %.1f s, %.0f samples/s' % (epoch, loss, elapsed, samples / elapsed))
+        save_training_state(state_path, epoch, net, optimizer, scheduler)
+    torch.save(net.state_dict(), CHECKPOINT_PATH)
+
 
+def train(net, criterion, optimizer, trainloader, epoch) -> tuple:
+    """One epoch over trainloader, whose batches arrive augmented.
 
-def train(net, criterion, optimizer, trainloader, epoch):
+    Returns the mean loss and the number of samples seen.
+    """
     running_loss = 0.0
+    samples = batches = 0
+    start = time.perf_counter()
     for i, data in enumerate(trainloader, 0):
-        inputs = Variable(data['image'].float())
-        labels = Variable(data['label'].long())
+        inputs = data['image'].float()
+        labels = data['label'].long()
         optimizer.zero_grad()
 
         # forward + backward + optimize
@@ -58,9 +172,60 @@ def train(net, criterion, optimizer, trainloader, epoch):
 
         # print statistics
         running_loss += loss.item()
-        if i % 100 == 0:
-            print('[%d, %5d] loss: %.6f' % (epoch, i, running_loss / (i + 1)))
+        samples += len(inputs)
+        batches += 1
+        if i % LOG_INTERVAL == 0:
+            print('[%d, %5d] loss: %.6f, %.0f samples/s' % (
+                epoch, i, running_loss / batches, samples / (time.perf_counter() - start)))
+    return running_loss / max(batches, 1), samples
+
+
+def train_sequence_head(num_epochs: int=SEQUENCE_EPOCHS, num_workers: int=LOADER_WORKERS, threads: int=None):
+    """Fit SequenceHead on synthesized clips, over the frozen embeddings of the trained Net."""
+    torch.set_num_threads(training_threads(threads, num_workers))
+    net = Net().float().eval()
+    net.load_state_dict(torch.load(CHECKPOINT_PATH))
+    head = SequenceHead()
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(head.parameters(), lr=1e-3)
+
+    # clips are synthesized as they are loaded, workers keep that off the training thread
+    trainloader = torch.utils.data.DataLoader(
+        SignSequences('data/sign_mnist_train.csv'), batch_size=SEQUENCE_BATCH_SIZE, **loader_options(num_workers))
+    for epoch in range(num_epochs):
+        running_loss = 0.0
+        start = time.perf_counter()
+        for i, data in enumerate(trainloader, 0):
+            clips = data['frames']
+            with torch.no_grad():
+                # the trunk is frozen, embed every frame of every clip in one pass
+                embeddings = net.embed(clips.flatten(0, 1)).view(clips.shape[0], clips.shape[1], -1)
+            optimizer.zero_grad()
+            loss = criterion(head(embeddings), data['label'])
+            loss.backward()
+            optimizer.step()
+
+            running_loss += loss.item()
+            if i % LOG_INTERVAL == 0:
+                print('[%d, %5d] loss: %.6f' % (epoch, i, running_loss / (i + 1)))
+        elapsed = time.perf_counter() - start
+        print('epoch %d: %.1f s, %.0f clips/s' % (epoch, elapsed, len(trainloader.dataset) / elapsed))
+    torch.save(head.state_dict(), SEQUENCE_CHECKPOINT_PATH)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Train the letter classifier, or the sequence head for J and Z.')
+    parser.add_argument('--sequence', action='store_true', help='train the sequence head on the trained Net')
+    parser.add_argument('--epochs', type=int, default=None,
+                        help='epochs to train, default %d (%d for --sequence)' % (EPOCHS, SEQUENCE_EPOCHS))
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=LOADER_WORKERS, help='loader processes, 0 for none')
+    parser.add_argument('--threads', type=int, default=None, help='torch CPU threads, default the cores not taken by --workers')
+    parser.add_argument('--resume', action='store_true', help='continue from the epoch saved in --state')
+    parser.add_argument('--state', default=TRAINING_STATE_PATH, help='resumable training state file')
+    args = parser.parse_args()
+
+    if args.sequence:
+        train_sequence_head(args.epochs or SEQUENCE_EPOCHS, args.workers, args.threads)
+    else:
+        main(args.epochs or EPOCHS, args.batch_size, args.workers, args.threads, args.resume, args.state)
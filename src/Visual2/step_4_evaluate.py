@@ -1,5 +1,4 @@
 from torch.utils.data import Dataset
-from torch.autograd import Variable
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
@@ -8,65 +7,193 @@ import numpy as np
 
 import onnx
 import onnxruntime as ort
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
 
-from step_2_dataset import get_train_test_loaders
-from step_3_train import Net
+import os
+import time
 
+from engines import OrtEngine, measure_latency
+from model_config import (CHECKPOINT_PATH, EMBEDDING_SIZE, INDEX_TO_LETTER, LETTER_BIAS, MEAN, MODEL_PATHS,
+                          SEQUENCE_CHECKPOINT_PATH, SEQUENCE_HEAD_PATH, SEQUENCE_LENGTH, STD)
+from step_2_dataset import BatchAugment, SignLanguageMNIST, SignSequences, get_train_test_loaders
+from step_3_train import EmbeddingNet, Net, SequenceHead
 
-def evaluate(outputs: Variable, labels: Variable) -> float:
+EVAL_BATCH_SIZE = 1024  # images per forward pass when measuring accuracy
+SEQUENCE_EVAL_CLIPS = 2000  # synthesized test-set clips the sequence head is scored on
+CALIBRATION_SAMPLES = 500  # training images used to calibrate int8 activation ranges
+
+
+class SignLanguageCalibrationReader(CalibrationDataReader):
+    """Feeds a fixed random sample of the training set to the int8 calibrator.
+
+    The images are normalized like the ones models are scored on, without
+    the random crops of the training transform, so every export calibrates
+    on the same inputs.
+    """
+
+    def __init__(self, dataset: SignLanguageMNIST, num_samples: int=CALIBRATION_SAMPLES):
+        rng = np.random.default_rng(0)
+        # sorted, the memmapped samples are then read front to back
+        indices = np.sort(rng.choice(len(dataset), min(num_samples, len(dataset)), replace=False))
+        images = normalize(torch.from_numpy(dataset._samples[indices]).permute(0, 3, 1, 2)).numpy()
+        self._inputs = iter([{'input': image[None]} for image in images])
+
+    def get_next(self):
+        return next(self._inputs, None)
+
+
+class RawInputNet(nn.Module):
+    """Net taking raw N x 1 x 28 x 28 uint8 pixels.
+
+    Normalization and the camera's LETTER_BIAS logit adjustments run inside
+    the graph, so the caller only has to crop and shrink the frame.
+    """
+
+    def __init__(self, net: Net):
+        super(RawInputNet, self).__init__()
+        self.net = net
+        bias = torch.zeros(len(INDEX_TO_LETTER))
+        for letter, value in LETTER_BIAS.items():
+            bias[INDEX_TO_LETTER.index(letter)] = value
+        self.register_buffer('bias', bias)
+
+    def forward(self, x):
+        x = x.float() * (1. / STD) - MEAN / STD
+        return self.net(x) + self.bias
+
+
+def export_int8(fp32_path: str, int8_path: str, dataset: SignLanguageMNIST):
+    """Statically quantize weights and activations to int8, calibrated on dataset."""
+    quantize_static(
+        fp32_path, int8_path, SignLanguageCalibrationReader(dataset),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True)
+
+
+def evaluate(outputs: np.ndarray, labels: torch.Tensor) -> float:
     """Evaluate neural network outputs against non-one-hotted labels."""
     Y = labels.numpy()
     Yhat = np.argmax(outputs, axis=1)
     return float(np.sum(Yhat == Y))
 
 
+def normalize(images: torch.Tensor) -> torch.Tensor:
+    """Normalize a uint8 batch without augmenting it, so every model is scored on the same inputs."""
+    # a fresh standard-layout tensor, batches sliced from the dataset are channels-last views
+    return (images.float().clone(memory_format=torch.contiguous_format) - MEAN) * (1. / STD)
+
+
 def batch_evaluate(
         net: Net,
-        dataloader: torch.utils.data.DataLoader) -> float:
+        dataloader: torch.utils.data.DataLoader,
+        augment: BatchAugment=None) -> float:
     """Evaluate neural network in batches, if dataset is too large."""
     score = n = 0.0
-    for batch in dataloader:
-        n += len(batch['image'])
-        outputs = net(batch['image'])
-        if isinstance(outputs, torch.Tensor):
-            outputs = outputs.detach().numpy()
-        score += evaluate(outputs, batch['label'][:, 0])
+    with torch.inference_mode():
+        for batch in dataloader:
+            images = batch['image'] if augment is None else augment(batch['image'])
+            n += len(images)
+            outputs = net(images)
+            if isinstance(outputs, torch.Tensor):
+                outputs = outputs.detach().numpy()
+            score += evaluate(outputs, batch['label'][:, 0])
     return score / n
 
 
+def timed_evaluate(net, dataloader, augment, name: str) -> float:
+    """batch_evaluate, printing accuracy and images per second."""
+    start = time.perf_counter()
+    acc = batch_evaluate(net, dataloader, augment) * 100.
+    rate = len(dataloader.dataset) / (time.perf_counter() - start)
+    print('%s accuracy: %.1f (%.0f images/s)' % (name, acc, rate))
+    return acc
+
+
+def export_sequence(net: Net):
+    """Export the sequence head and score it on synthesized clips of the test set."""
+    head = SequenceHead().eval()
+    head.load_state_dict(torch.load(SEQUENCE_CHECKPOINT_PATH))
+    dummy = torch.randn(1, SEQUENCE_LENGTH, EMBEDDING_SIZE)
+    torch.onnx.export(head, dummy, SEQUENCE_HEAD_PATH, input_names=['input'], output_names=['output'],
+                      dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
+    onnx.checker.check_model(onnx.load(SEQUENCE_HEAD_PATH))
+
+    clips = SignSequences('data/sign_mnist_test.csv', num_clips=SEQUENCE_EVAL_CLIPS, seed=0)
+    loader = torch.utils.data.DataLoader(clips, batch_size=EVAL_BATCH_SIZE // SEQUENCE_LENGTH)
+    score = 0.0
+    with torch.inference_mode():
+        for batch in loader:
+            frames = batch['frames']
+            embeddings = net.embed(frames.flatten(0, 1)).view(frames.shape[0], frames.shape[1], -1)
+            score += evaluate(head(embeddings).numpy(), batch['label'])
+    print('Sequence head accuracy on test-set clips: %.1f' % (score / len(clips) * 100.))
+
+
 def validate():
-    trainloader, testloader = get_train_test_loaders()
+    trainloader, testloader = get_train_test_loaders(EVAL_BATCH_SIZE, batch_augment=True)
+    # deterministic inputs, random crops would make the rows of the report incomparable
+    augment = normalize
     net = Net().float().eval()
 
-    pretrained_model = torch.load("checkpoint.pth")
+    pretrained_model = torch.load(CHECKPOINT_PATH)
     net.load_state_dict(pretrained_model)
 
     print('=' * 10, 'PyTorch', '=' * 10)
-    train_acc = batch_evaluate(net, trainloader) * 100.
-    print('Training accuracy: %.1f' % train_acc)
-    test_acc = batch_evaluate(net, testloader) * 100.
-    print('Validation accuracy: %.1f' % test_acc)
+    timed_evaluate(net, trainloader, augment, 'Training')
+    timed_evaluate(net, testloader, augment, 'Validation')
 
-    trainloader, testloader = get_train_test_loaders(1)
-
-    # export to onnx
-    fname = "signlanguage.onnx"
+    # export to onnx, with a dynamic batch dimension
+    fname = MODEL_PATHS['fp32']
     dummy = torch.randn(1, 1, 28, 28)
-    torch.onnx.export(net, dummy, fname, input_names=['input'])
+    torch.onnx.export(net, dummy, fname, input_names=['input'], output_names=['output'],
+                      dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
 
     # check exported model
     model = onnx.load(fname)
     onnx.checker.check_model(model)  # check model is well-formed
 
-    # create runnable session with exported model
-    ort_session = ort.InferenceSession(fname)
-    net = lambda inp: ort_session.run(None, {'input': inp.data.numpy()})[0]
-
-    print('=' * 10, 'ONNX', '=' * 10)
-    train_acc = batch_evaluate(net, trainloader) * 100.
-    print('Training accuracy: %.1f' % train_acc)
-    test_acc = batch_evaluate(net, testloader) * 100.
-    print('Validation accuracy: %.1f' % test_acc)
+    # logits followed by the embedding, feeding the sequence head from the same pass
+    torch.onnx.export(EmbeddingNet(net).eval(), dummy, MODEL_PATHS['embed'], input_names=['input'],
+                      output_names=['output'], dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
+    onnx.checker.check_model(onnx.load(MODEL_PATHS['embed']))
+    if os.path.exists(SEQUENCE_CHECKPOINT_PATH):  # trained by `step_3_train.py --sequence`
+        export_sequence(net)
+
+    # uint8-input variant with preprocessing and letter biases in the graph
+    raw_net = RawInputNet(net).eval()
+    dummy = torch.randint(0, 256, (1, 1, 28, 28), dtype=torch.uint8)
+    torch.onnx.export(raw_net, dummy, MODEL_PATHS['raw'], input_names=['input'], output_names=['output'],
+                      dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}})
+    onnx.checker.check_model(onnx.load(MODEL_PATHS['raw']))
+    pixels = np.random.randint(0, 256, (64, 1, 28, 28)).astype(np.uint8)
+    expected = ort.InferenceSession(fname).run(None, {'input': ((pixels - MEAN) / STD).astype(np.float32)})[0]
+    expected += raw_net.bias.numpy()
+    actual = ort.InferenceSession(MODEL_PATHS['raw']).run(None, {'input': pixels})[0]
+    print('raw model max logit difference: %.2e' % np.max(np.abs(actual - expected)))
+
+    # int8 variant, calibrated on the training set
+    export_int8(fname, MODEL_PATHS['int8'], SignLanguageMNIST('data/sign_mnist_train.csv'))
+
+    report = []
+    for variant in ('fp32', 'int8'):
+        # create runnable engine with exported model, logits are consumed before the next call
+        engine = OrtEngine(variant)
+        net = lambda inp: engine(inp.numpy())
+
+        print('=' * 10, 'ONNX', variant, '=' * 10)
+        train_acc = timed_evaluate(net, trainloader, augment, 'Training')
+        test_acc = timed_evaluate(net, testloader, augment, 'Validation')
+        latency = measure_latency(engine)
+        # serialized size, including weights the exporter may keep in an external file
+        size = len(onnx.load(MODEL_PATHS[variant]).SerializeToString()) / 1024.
+        report.append((variant, train_acc, test_acc, latency, size))
+
+    print('=' * 10, 'Summary', '=' * 10)
+    print('%-6s %9s %9s %12s %10s' % ('model', 'train %', 'test %', 'latency ms', 'size KiB'))
+    for row in report:
+        print('%-6s %9.1f %9.1f %12.3f %10.1f' % row)
 
 
 if __name__ == '__main__':
@@ -2,30 +2,244 @@ import cv2
 from cv2 import data
 import numpy as np
 import onnxruntime as ort
+import queue
+import threading
 import time
 import os
 import sys
+from collections import deque
+from typing import Callable, Optional
 
 path = os.path.dirname(os.path.realpath(__file__))
 src = "/".join(path.split('/')[:-1])
 
 sys.path.append(path)
 sys.path.append(src) 
+sys.path.append("/".join(path.split('/')[:-2]))
 
+from src.metrics import METRICS
 from src.SONAR.audio import SONAR
+from src.SONAR.ring_buffer import RingBuffer
+from engines import make_engine
+from inference_service import ServiceClient
+from model_config import (EMBEDDING_SIZE, EMBEDDING_VARIANTS, ENGINE, INDEX_TO_LETTER, LETTER_BIAS, MEAN,
+                          MODEL_VARIANT, SEQUENCE_CLASSES, SEQUENCE_HEAD_PATH, SEQUENCE_LENGTH, STD)
+from voting import LetterVoter
 
 COUNT = 150
 THRESHOLD = 10
 CONFIDENCE_THRESHOLD = 1
-DRAW_FRAMES = 20  # number of frames to hold at a J
+DRAW_FRAMES = 20  # number of frames to hold at a J or Z
+SEQUENCE_THRESHOLD = 0.9  # sequence head probability needed to emit a dynamic letter
 
-# movement count range for j detection
-J_MOVE_LOW = 7
-J_MOVE_HIGH = 14
+# without the sequence head, J is guessed from SONAR instead:
+# movement duration range for j detection, in seconds (7 to 14 windows of 2048 samples at 44.1 kHz)
+J_MOVE_LOW = 0.32
+J_MOVE_HIGH = 0.65
 
 # possible letters detected at the end of a J
 J_END_LETTERS = ['I', None]
 
+RENDER_FPS = 60  # throttle drawing to the display refresh rate
+QUEUE_TIMEOUT = 0.1  # seconds a stage waits for input before rechecking for shutdown
+STATS_WINDOW = 300  # number of recent timings kept per stage
+STATS_INTERVAL = 5  # seconds between stage timing reports
+GATE_THRESHOLD = 4.  # mean absolute change of the 28 x 28 input, in gray levels, that triggers inference
+GATE_MAX_SKIPS = 15  # consecutive frames that may reuse the cached logits
+# engine options for single frames: IO binding is slower for them and reuses its output buffer
+CAMERA_ENGINE_OPTIONS = {'ort': {'io_binding': False}}
+END_OF_STREAM = None  # queued after the last frame, and after its result, when the input runs out
+
+
+class StageTimer:
+    """Rolling durations of one pipeline stage, also fed to the shared metrics."""
+
+    def __init__(self, name: str, size: int=STATS_WINDOW):
+        self.name = name
+        self.durations = deque(maxlen=size)  # size None keeps every timing
+        self.dropped = 0  # items this stage overwrote before the next stage took them
+        self.skipped = 0  # items handled from cache instead of doing the work
+        self._hist = METRICS.histogram('camera.%s_seconds' % name)
+        self._dropped = METRICS.counter('camera.%s_dropped' % name)
+        self._skipped = METRICS.counter('camera.%s_skipped' % name)
+
+    def add(self, seconds: float):
+        self.durations.append(seconds)
+        self._hist.observe(seconds)
+
+    def drop(self):
+        self.dropped += 1
+        self._dropped.incr()
+
+    def skip(self):
+        self.skipped += 1
+        self._skipped.incr()
+
+    def percentiles(self, qs=(50, 95, 99)) -> np.ndarray:
+        """Duration percentiles in milliseconds."""
+        if not self.durations:
+            return np.full(len(qs), np.nan)
+        return np.percentile(np.array(self.durations) * 1000., qs)
+
+    def summary(self) -> str:
+        if not self.durations:
+            return '%s: -' % self.name
+        ms = np.array(self.durations) * 1000.
+        text = '%s: %.1f ms avg, %.1f ms max' % (self.name, ms.mean(), ms.max())
+        if self.dropped:
+            text += ', %d dropped' % self.dropped
+        if self.skipped:
+            text += ', %d skipped' % self.skipped
+        return text
+
+
+class Preprocessor:
+    """Turn a camera frame into model input without full-frame intermediates.
+
+    The center crop is a view, it is shrunk straight to 28 x 28 and only then
+    converted to grayscale, all into buffers reused across frames. With
+    `raw_input` the uint8 pixels go to the model as is, otherwise they are
+    normalized in float32 in place.
+    """
+
+    def __init__(self, raw_input: bool):
+        self.raw_input = raw_input
+        self._small = np.empty((28, 28, 3), dtype=np.uint8)
+        self._pixels = np.empty((1, 1, 28, 28), dtype=np.uint8)
+        self._input = self._pixels if raw_input else np.empty((1, 1, 28, 28), dtype=np.float32)
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """28 x 28 uint8 grayscale of the latest frame, reused across frames."""
+        return self._pixels[0, 0]
+
+    def __call__(self, frame: np.ndarray) -> np.ndarray:
+        cv2.resize(center_crop(frame), (28, 28), dst=self._small)
+        cv2.cvtColor(self._small, cv2.COLOR_RGB2GRAY, dst=self._pixels[0, 0])
+        if not self.raw_input:
+            np.subtract(self._pixels, MEAN, out=self._input, dtype=np.float32)
+            self._input *= 1. / STD
+        return self._input
+
+
+class MotionTrack:
+    """SONAR motion events lined up with frame capture times.
+
+    Every event since the previous frame is drained, so movements that start
+    and end between two frames still count, whatever the frame rate.
+    """
+
+    def __init__(self, sonar):
+        self.sonar = sonar
+        self.moving_since = None  # start of the movement still in progress
+        self.finished = deque()  # finished movements not yet reported to a frame
+
+    def at(self, captured: float) -> tuple:
+        """Motion as seen by a frame captured at time.monotonic() `captured`.
+
+        Returns whether the hand was moving when the frame was taken and the
+        durations of the movements that ended since the previous frame.
+        """
+        for event in self.sonar.drain_events():
+            if event.end is None:
+                self.moving_since = event.start
+            else:
+                self.finished.append(event)
+                if self.moving_since == event.start:
+                    self.moving_since = None
+
+        moving = self.moving_since is not None and self.moving_since <= captured
+        durations = []
+        # movements are reported to the first frame taken after they ended
+        while self.finished and self.finished[0].end <= captured:
+            durations.append(self.finished.popleft().duration)
+        for event in self.finished:
+            moving = moving or event.start <= captured
+        return moving, durations
+
+
+class InferenceGate:
+    """Reuse the last logits while the model input stays the same.
+
+    A frame is classified again only if its 28 x 28 input differs from the
+    last classified one by more than `threshold` gray levels on average, if
+    SONAR reports movement, or after `max_skips` frames in a row were served
+    from the cache.
+    """
+
+    def __init__(self, threshold: float=GATE_THRESHOLD, max_skips: int=GATE_MAX_SKIPS):
+        self.threshold = threshold
+        self.max_skips = max_skips
+        self._pixels = np.empty((28, 28), dtype=np.uint8)  # input of the cached logits
+        self._logits = None
+        self._skips = 0
+
+    def cached(self, pixels: np.ndarray, moving: bool) -> Optional[np.ndarray]:
+        """The cached logits if they still hold for `pixels`, else None."""
+        if (self._logits is None or moving or self._skips >= self.max_skips or
+                cv2.norm(pixels, self._pixels, cv2.NORM_L1) > self.threshold * pixels.size):
+            return None
+        self._skips += 1
+        return self._logits
+
+    def store(self, pixels: np.ndarray, logits: np.ndarray):
+        np.copyto(self._pixels, pixels)
+        self._logits = logits
+        self._skips = 0
+
+
+class SequenceClassifier:
+    """Dynamic letters from the embeddings of the last `length` frames.
+
+    Models in EMBEDDING_VARIANTS return each frame's embedding with its
+    logits, so it is computed once per frame. Embeddings are kept in a
+    RingBuffer whose window is a view, and each frame costs one pass of the
+    small sequence head instead of `length` passes of the whole model.
+    """
+
+    def __init__(self, head_path: str=SEQUENCE_HEAD_PATH, length: int=SEQUENCE_LENGTH,
+                 threshold: float=SEQUENCE_THRESHOLD):
+        self.session = ort.InferenceSession(head_path)
+        self.length = length
+        self.threshold = threshold
+        self.embeddings = RingBuffer(length, frame_shape=(EMBEDDING_SIZE,))
+        self.frames = 0  # embeddings pushed since the last reset
+
+    def reset(self):
+        """Forget the window, e.g. once its motion has been reported."""
+        self.frames = 0
+
+    def push(self, embedding: np.ndarray) -> Optional[str]:
+        """Add the newest frame's (1, EMBEDDING_SIZE) embedding, return the dynamic letter seen, if any."""
+        self.embeddings.write(embedding)
+        self.frames += 1
+        if self.frames < self.length:
+            return None
+        window = self.embeddings.latest(self.length)[np.newaxis]
+        y = self.session.run(None, {'input': window})[0][0]
+        p = np.exp(y - y.max())
+        p /= p.sum()
+        index = int(np.argmax(p))
+        return SEQUENCE_CLASSES[index] if p[index] > self.threshold else None
+
+
+def put_latest(q: queue.Queue, item) -> bool:
+    """Put item on a bounded queue, evicting the oldest entries if it is full.
+
+    Returns True if an older item was dropped to make room.
+    """
+    dropped = False
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped = True
+            except queue.Empty:
+                pass
+
 def center_crop(frame):
     h, w, _ = frame.shape
     start = abs(h - w) // 2
@@ -34,60 +248,120 @@ def center_crop(frame):
     return frame[:, start: start + h]
 
 
-def detect_signs(sonar):
+def hand_over(q: queue.Queue, item, stop: threading.Event, lossless: bool) -> bool:
+    """Pass item to the next stage.
+
+    Live, a pending item is replaced so the next stage always gets the newest
+    one; lossless (benchmarks over recorded input) waits for room instead.
+    Returns True if an older item was dropped.
+    """
+    if not lossless:
+        return put_latest(q, item)
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=QUEUE_TIMEOUT)
+            break
+        except queue.Full:
+            pass
+    return False
+
+
+def capture_frames(cap, frames: queue.Queue, stop: threading.Event, timer: StageTimer,
+                   lossless: bool=False):
+    """Read camera frames as fast as they come, keeping only the latest one.
+
+    When the input runs out, END_OF_STREAM is queued behind the last frame.
+    """
+    while not stop.is_set():
+        start = time.perf_counter()
+        ok, frame = cap.read()
+        if not ok:
+            hand_over(frames, END_OF_STREAM, stop, lossless)
+            break
+        timer.add(time.perf_counter() - start)
+        if hand_over(frames, (time.monotonic(), frame), stop, lossless):
+            timer.drop()
+
+
+def recognize_frames(sonar, ort_session, raw_input: bool, frames: queue.Queue, results: queue.Queue,
+                     stop: threading.Event, timer: StageTimer, lossless: bool=False, gate: bool=True,
+                     sequence: SequenceClassifier=None, on_first_letter: Callable=None):
+    """Preprocess, classify and vote on the latest frame, publishing the letter.
+
+    With `gate`, frames whose input barely changed reuse the previous logits,
+    see InferenceGate; each reuse is counted by `timer.skip()`. With
+    `sequence`, the model must output embeddings after the logits and J and
+    Z come from the sequence head, otherwise J is guessed from SONAR.
+    `on_first_letter(letter)` is called once, when a letter is first recognized.
+    """
     # constants
-    index_to_letter = list('ABCDEFGHIKLMNOPQRSTUVWXY')
-    mean = 0.485 * 255.
-    std = 0.229 * 255.
-    buffer = [(None, 0) for _ in range(COUNT)]
+    index_to_letter = list(INDEX_TO_LETTER)
+    num_letters = len(index_to_letter)
+    dynamic_letters = [letter for letter in SEQUENCE_CLASSES if letter is not None]
+    preprocess = Preprocessor(raw_input)
+    # models taking raw pixels apply the letter biases themselves
+    bias = np.zeros(len(index_to_letter), dtype=np.float32)
+    if not raw_input:
+        for letter, value in LETTER_BIAS.items():
+            bias[index_to_letter.index(letter)] = value
+    voter = LetterVoter(COUNT, CONFIDENCE_THRESHOLD)
+    motion = MotionTrack(sonar)
+    inference_gate = InferenceGate() if gate else None
     previous_letter = None
 
     # track number of frames since last letter change, to allow
     # human-readable letter draw duration
     num_since_change = 0
 
-    # create runnable session with exported model
-    ort_session = ort.InferenceSession(path + "/signlanguage.onnx")
-    cap = cv2.VideoCapture(0)
-    
-    while True:
-        # Capture frame-by-frame
-        _, frame = cap.read()
+    while not stop.is_set():
+        try:
+            item = frames.get(timeout=QUEUE_TIMEOUT)
+        except queue.Empty:
+            continue
+        if item is END_OF_STREAM:
+            # every frame before it has been handled, pass the end on to the render stage
+            hand_over(results, END_OF_STREAM, stop, lossless)
+            break
+        captured, frame = item
+        start = time.perf_counter()
+        METRICS.incr('camera.frames')
+        METRICS.gauge('camera.frame_queue', frames.qsize())
 
         num_since_change += 1
 
         # preprocess data
-        frame = center_crop(frame)
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        x = cv2.resize(frame, (28, 28))
-        x = (x - mean) / std
+        x = preprocess(frame)
+        frame = center_crop(frame)  # shown by the render stage
 
-        # hold a j for at least DRAW_FRAMES
-        if previous_letter == 'J' and num_since_change < DRAW_FRAMES:
+        # hold a j or z for at least DRAW_FRAMES
+        if previous_letter in dynamic_letters and num_since_change < DRAW_FRAMES:
             # continue showing output
-            frame = cv2.flip(frame, 1)
-            cv2.putText(frame, previous_letter, (100, 100), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 255, 0), thickness=2)
-            cv2.imshow("Sign Language Translator", frame)
-            cv2.waitKey(1)  # ensure output is drawn
+            if hand_over(results, (captured, frame, previous_letter, None), stop, lossless):
+                timer.drop()
+            timer.add(time.perf_counter() - start)
             continue
 
-        # run the predictor
-        x = x.reshape(1, 1, 28, 28).astype(np.float32)
-        y = ort_session.run(None, {'input': x})[0]
-
-        # artificially bias towards 'I'
-        y[0][8] += 10
-        # artificially decrease 'P'
-        y[0][14] -= 10
+        # extract movement data from sonar, as of when the frame was captured
+        movement_flag, move_durations = motion.at(captured)
+
+        # run the predictor, unless the input is the same as last time
+        y = None if inference_gate is None else inference_gate.cached(preprocess.pixels, movement_flag)
+        if y is None:
+            # own the logits, they are biased in place and may be cached by the gate
+            y = np.array(ort_session.run(None, {'input': x})[0])
+            y[:, :num_letters] += bias
+            if inference_gate is not None:
+                inference_gate.store(preprocess.pixels, y)
+        else:
+            timer.skip()
+        dynamic_letter = None if sequence is None else sequence.push(y[:, num_letters:])
+        y = y[:, :num_letters]
 
         index = np.argmax(y, axis=1)
         confidence = y[0][index][0]
         frame_letter = None
 
-        # extract movement data from sonar
-        movement_flag = sonar.is_moving()
-        move_count = sonar.read_move_count()
-        potential_j = J_MOVE_LOW <= move_count <= J_MOVE_HIGH
+        potential_j = any(J_MOVE_LOW <= duration <= J_MOVE_HIGH for duration in move_durations)
 
         #if move_count > 0 and previous_letter == 'J':
         #    previous_letter = None
@@ -95,39 +369,14 @@ def detect_signs(sonar):
         # propagate buffer
         if not movement_flag:
             if confidence > THRESHOLD:
-                frame_letter = index_to_letter[int(index)]
-                buffer.append((frame_letter, confidence))
+                frame_letter = index_to_letter[int(index[0])]
+                voter.push(frame_letter, confidence)
             else:
-                buffer.append((None, 1-confidence))
-
-            buffer.pop(0)
+                voter.push(None, 1-confidence)
         # frame_letter now holds the most confident letter from the current frame
 
-        # find average confidences per letter across the buffer
-        average_confidences = {}
-
-        for data_item in buffer:
-            letter = data_item[0]
-
-            if letter in average_confidences:
-                average_confidences[letter] = average_confidences[letter][0] + data_item[1], average_confidences[letter][1] + 1
-            else:
-                average_confidences[letter] = data_item[1], 1
-
         # find most confident letter across recent frames
-        best_confidence = CONFIDENCE_THRESHOLD
-        best_letter = None
-
-        for letter in average_confidences:
-            sum_confidence = average_confidences[letter][0]
-            count_confidence = average_confidences[letter][1]
-
-            if (count_confidence > COUNT/len(average_confidences)):
-                # weight average confidence by frequency and average of confidences in buffer
-                average_confidence = sum_confidence/count_confidence + 3 * count_confidence/COUNT
-                if average_confidence > best_confidence:
-                    best_letter = letter
-                    best_confidence = average_confidence
+        best_letter = voter.best_letter()
 
         #if previous_letter != 'J':
         #    letter = best_letter
@@ -136,29 +385,167 @@ def detect_signs(sonar):
         letter = best_letter
 
         #print(letter, frame_letter, previous_letter, potential_j)
-        if potential_j and previous_letter == 'I':
-            print(frame_letter)  # to detecte J_END_LETTERS
+        if dynamic_letter is not None:
+            letter = dynamic_letter
+            sequence.reset()  # report each motion once
+        elif sequence is None and potential_j and previous_letter == 'I':
+            METRICS.incr('camera.j_candidates')
             if frame_letter in J_END_LETTERS:
                 letter = 'J'
 
-        # mirror
-        frame = cv2.flip(frame, 1)
-        cv2.putText(frame, letter, (100, 100), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 255, 0), thickness=2)
-        cv2.putText(frame, frame_letter, (100, 200), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 255, 0), thickness=2)
-        cv2.imshow("Sign Language Translator", frame)
-
         if letter != previous_letter:
             num_since_change = 0
         previous_letter = letter
+        if letter is not None and on_first_letter is not None:
+            on_first_letter(letter)
+            on_first_letter = None
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            sonar.abort()
+        sonar.movement_flag = False
+
+        if hand_over(results, (captured, frame, letter, frame_letter), stop, lossless):
+            timer.drop()
+        timer.add(time.perf_counter() - start)
+
+
+def render_results(sonar, results: queue.Queue, stop: threading.Event, timers: dict):
+    """Draw the most recent result, at most RENDER_FPS times per second."""
+    period = 1. / RENDER_FPS
+    next_draw = last_report = time.perf_counter()
+
+    while not stop.is_set():
+        delay = next_draw - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            item = results.get(timeout=QUEUE_TIMEOUT)
+        except queue.Empty:
+            continue
+        if item is END_OF_STREAM:
             break
+        captured, frame, letter, frame_letter = item
+        start = time.perf_counter()
+        METRICS.gauge('camera.result_queue', results.qsize())
 
-        sonar.movement_flag = False
+        # grayscale for display, then mirror
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        frame = cv2.flip(frame, 1)
+        cv2.putText(frame, letter, (100, 100), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 255, 0), thickness=2)
+        cv2.putText(frame, frame_letter, (100, 200), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 255, 0), thickness=2)
+        cv2.imshow("Sign Language Translator", frame)
+        key = cv2.waitKey(1)
+
+        now = time.perf_counter()
+        timers['render'].add(now - start)
+        timers['latency'].add(time.monotonic() - captured)
+        next_draw = start + period
 
-    cap.release()
-    cv2.destroyAllWindows()
+        if now - last_report >= STATS_INTERVAL:
+            print(' | '.join(timer.summary() for timer in timers.values()))
+            last_report = now
+
+        if key & 0xFF == ord('q'):
+            sonar.abort()
+            stop.set()
+
+
+def run_pipeline(sonar, ort_session, raw_input: bool, cap, render,
+                 lossless: bool=False, stats_window: int=STATS_WINDOW, gate: bool=True,
+                 sequence: SequenceClassifier=None, on_first_letter: Callable=None) -> dict:
+    """Run capture and recognition threads feeding `render` on this thread.
+
+    `render(sonar, results, stop, timers)` consumes result tuples until
+    `stop` is set or END_OF_STREAM arrives. Returns the stage timers.
+    """
+    # capture -> recognize -> render, each stage keeps only the newest item so
+    # a slow stage drops stale frames instead of queueing them
+    stop = threading.Event()
+    frames = queue.Queue(maxsize=1)
+    results = queue.Queue(maxsize=1)
+    timers = {name: StageTimer(name, stats_window) for name in ('capture', 'infer', 'render', 'latency')}
+
+    threads = [
+        threading.Thread(target=capture_frames, args=(cap, frames, stop, timers['capture'], lossless)),
+        threading.Thread(target=recognize_frames,
+                         args=(sonar, ort_session, raw_input, frames, results, stop,
+                               timers['infer'], lossless, gate, sequence, on_first_letter)),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        render(sonar, results, stop, timers)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return timers
+
+
+def open_camera(index: int=0):
+    """Open a camera and wait for its first frame, some drivers take a second to start."""
+    cap = cv2.VideoCapture(index)
+    cap.read()
+    return cap
+
+
+def prepare_detection(model=MODEL_VARIANT, service=None, engine=ENGINE, timings: dict=None) -> tuple:
+    """Load the model and open the camera ahead of detect_signs.
+
+    The camera opens on a helper thread while the model loads, and the model
+    runs once on a blank frame so its first real frame is not slowed down by
+    allocations. main.py calls this while SONAR calibrates. Seconds spent on
+    each are stored in `timings` under 'model' and 'camera'.
+    Returns (runner, raw_input, sequence, cap) for detect_signs.
+    """
+    timings = {} if timings is None else timings
+    camera = {}
+
+    def start_camera():
+        start = time.perf_counter()
+        camera['cap'] = open_camera()
+        timings['camera'] = time.perf_counter() - start
+
+    camera_thread = threading.Thread(target=start_camera, daemon=True)
+    camera_thread.start()
+
+    start = time.perf_counter()
+    # create runnable engine with exported model, see model_config.MODEL_PATHS and engines.ENGINES
+    # or share a BatchingInferenceService with other streams
+    if service is None:
+        runner = make_engine(engine, model, **CAMERA_ENGINE_OPTIONS.get(engine, {}))
+        raw_input = runner.raw_input
+        runner(np.zeros((1, 1, 28, 28), dtype=np.uint8 if raw_input else np.float32))
+    else:
+        runner = service.client()
+        raw_input = service.engine.raw_input
+    # models that output embeddings feed the sequence head for J and Z
+    sequence = SequenceClassifier() if model in EMBEDDING_VARIANTS else None
+    timings['model'] = time.perf_counter() - start
+
+    camera_thread.join()
+    return runner, raw_input, sequence, camera['cap']
+
+
+def detect_signs(sonar, model=MODEL_VARIANT, service=None, engine=ENGINE, prepared: tuple=None,
+                 on_first_letter: Callable=None):
+    """Recognize signs from the camera until 'q' is pressed.
+
+    `prepared` is the result of an earlier prepare_detection call, which
+    makes the other model arguments unused.
+    """
+    if prepared is None:
+        prepared = prepare_detection(model, service, engine)
+    runner, raw_input, sequence, cap = prepared
+
+    try:
+        # drawing stays on the calling thread, as OpenCV's GUI expects
+        run_pipeline(sonar, runner, raw_input, cap, render_results, sequence=sequence,
+                     on_first_letter=on_first_letter)
+    finally:
+        if isinstance(runner, ServiceClient):
+            runner.close()  # the service stops waiting for this stream's frames
+        cap.release()
+        cv2.destroyAllWindows()
 
 if __name__ == '__main__':
     detect_signs(SONAR())
@@ -0,0 +1,55 @@
+from collections import deque
+from typing import Optional
+
+
+class LetterVoter:
+    """Sliding-window vote over per-frame letter predictions.
+
+    Keeps running confidence sums and counts per letter, so pushing a frame
+    and evicting the oldest one are O(1) and picking the winner only looks at
+    the letters currently present, whatever the window size.
+    """
+
+    def __init__(self, size: int, threshold: float):
+        """
+        Args:
+            size: Number of frames in the window, starts filled with (None, 0)
+            threshold: Minimum weighted confidence for a letter to win
+        """
+        self.size = size
+        self.threshold = threshold
+        self._window = deque([(None, 0.)] * size)
+        self._sums = {None: 0.}
+        self._counts = {None: size}
+
+    def push(self, letter: Optional[str], confidence: float):
+        """Add the newest frame's prediction and evict the oldest one."""
+        confidence = float(confidence)
+        old_letter, old_confidence = self._window.popleft()
+        self._window.append((letter, confidence))
+
+        self._counts[old_letter] -= 1
+        if self._counts[old_letter] == 0:
+            # drop the entry rather than keep a sum that has drifted from zero
+            del self._counts[old_letter]
+            del self._sums[old_letter]
+        else:
+            self._sums[old_letter] -= old_confidence
+
+        self._counts[letter] = self._counts.get(letter, 0) + 1
+        self._sums[letter] = self._sums.get(letter, 0.) + confidence
+
+    def best_letter(self) -> Optional[str]:
+        """Most confident letter across the window, or None."""
+        best_confidence = self.threshold
+        best_letter = None
+        num_letters = len(self._counts)
+
+        for letter, count in self._counts.items():
+            if count > self.size / num_letters:
+                # weight average confidence by frequency and average of confidences in buffer
+                average_confidence = self._sums[letter] / count + 3 * count / self.size
+                if average_confidence > best_confidence:
+                    best_letter = letter
+                    best_confidence = average_confidence
+        return best_letter
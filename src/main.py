@@ -1,3 +1,6 @@
+import time
+LAUNCHED = time.perf_counter()  # startup phases are reported relative to this
+
 import sys
 import os
 
@@ -5,21 +8,25 @@ path = os.path.dirname(os.path.realpath(__file__))
 path = "/".join(path.split('/')[:-1])
 sys.path.append(path) 
 
-from src.SONAR.audio import SONAR
-from src.Visual2.step_5_camera import detect_signs
+# only what SONAR needs is imported here, the SONAR child process re-imports this module;
+# the camera loop (OpenCV, ONNX Runtime) is imported by CameraWarmup and matplotlib only to plot
+from src.metrics import METRICS, export_json_lines, serve_metrics
+from src.SONAR.audio import ENABLE_DRAW, SONAR, pyplot
+from src.SONAR.process import SonarProcess
 
-import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
 import threading
+from contextlib import contextmanager
 
-matplotlib.use('TkAgg')
+IMPORTED = time.perf_counter()
 
 # determine whether this device is transmitter or receiver
 #TRANSMITTER = (len(sys.argv) >= 2 and sys.argv[1] == '-t')
 #if not TRANSMITTER:
 # from Visual.final import recognize
 
+# run the SONAR transmitter and receiver in their own process rather than in threads
+SONAR_PROCESS = (len(sys.argv) >= 2 and sys.argv[1] == '-p')
+
 # create separate threads for video and SONAR
 class ASLThread(threading.Thread):
     def __init__(self, threadID, function):
@@ -30,37 +37,152 @@ class ASLThread(threading.Thread):
     def run(self):
         self.func()
 
-# create audio object
-s = SONAR()
+
+class StartupTimer:
+    """When each startup phase ran, printed once the first letter is recognized."""
+
+    def __init__(self):
+        self.phases = [('imports', 0., IMPORTED - LAUNCHED)]  # (name, start, end) in seconds since launch
+        self._lock = threading.Lock()
+
+    def record(self, name, start, end):
+        with self._lock:
+            self.phases.append((name, start - LAUNCHED, end - LAUNCHED))
+        METRICS.gauge('startup.%s_seconds' % name.replace(' ', '_'), end - start)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def first_letter(self, letter):
+        total = time.perf_counter() - LAUNCHED
+        METRICS.gauge('startup.first_letter_seconds', total)
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        print('startup, seconds since launch:')
+        for name, start, end in phases:
+            print('  %-14s %6.2f -> %6.2f' % (name, start, end))
+        print('  %-14s %6.2f (%s)' % ('first letter', total, letter))
+
+
+# load the model and open the camera while SONAR starts and calibrates
+class CameraWarmup(threading.Thread):
+    def __init__(self, startup):
+        threading.Thread.__init__(self, daemon=True)
+        self.startup = startup
+        self.prepared = None
+        self.error = None
+
+    def run(self):
+        try:
+            with self.startup.phase('camera imports'):
+                from src.Visual2.step_5_camera import prepare_detection
+            done = time.perf_counter()
+            timings = {}
+            self.prepared = prepare_detection(timings=timings)
+            for name in ('model', 'camera'):  # loaded side by side
+                self.startup.record(name, done, done + timings[name])
+        except Exception as e:
+            self.error = e
+
+    def detect_signs(self, sonar):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        from src.Visual2.step_5_camera import detect_signs
+        detect_signs(sonar, prepared=self.prepared, on_first_letter=self.startup.first_letter)
+
+    # close the camera if detection never ran
+    def release(self):
+        self.join()
+        if self.prepared is not None:
+            self.prepared[-1].release()
+
+# where to publish metrics, None to disable
+METRICS_FILE = None  # append a JSON snapshot per interval, e.g. 'metrics.jsonl'
+METRICS_PORT = None  # serve snapshots on http://127.0.0.1:<port>/metrics
 
 # audio configuration
 LOW_FREQ = 18000
 HIGH_FREQ = 20000
 TRANSMIT_FREQ = (LOW_FREQ + HIGH_FREQ) / 2
 
-s.set_freq_range(LOW_FREQ, HIGH_FREQ)
-
-# create concurrent threads for each object
-threads = []
-# camera thread
-
-# transmitter thread
-# threads.append(ASLThread(2, lambda: s.play_freq(440)))
-# receiver thread
-threads.append(ASLThread(2, lambda: s.play_freq(TRANSMIT_FREQ)))
-threads.append(ASLThread(3, lambda: detect_signs(s)))
-
-plt.ion()
-plt.show()
-
-if s.calibrate_thresholds(TRANSMIT_FREQ):
-    for thread in threads:
-        thread.start()
-
-    s.receive_burst()
-
-    for thread in threads:
-        thread.join()
 
-# run cleanup
-s.destruct()
+# SONAR threads share the interpreter with the camera loop
+def run_threads():
+    startup = StartupTimer()
+    warmup = CameraWarmup(startup)
+    warmup.start()
+
+    # create audio object
+    with startup.phase('sonar'):
+        s = SONAR()
+        s.set_freq_range(LOW_FREQ, HIGH_FREQ)
+
+    # create concurrent threads for each object
+    threads = []
+    # camera thread
+
+    # transmitter thread
+    # threads.append(ASLThread(2, lambda: s.play_freq(440)))
+    # receiver thread
+    threads.append(ASLThread(2, lambda: s.play_freq(TRANSMIT_FREQ)))
+    threads.append(ASLThread(3, lambda: warmup.detect_signs(s)))
+
+    if ENABLE_DRAW:
+        import matplotlib
+        matplotlib.use('TkAgg')
+        plt = pyplot()
+        plt.ion()
+        plt.show()
+
+    with startup.phase('calibration'):
+        calibrated = s.calibrate_thresholds(TRANSMIT_FREQ)
+    if calibrated:
+        for thread in threads:
+            thread.start()
+
+        s.receive_burst()
+
+        for thread in threads:
+            thread.join()
+    else:
+        warmup.release()
+
+    # run cleanup
+    s.destruct()
+
+
+# SONAR runs in a child process, the camera loop reads its results from shared memory
+def run_process():
+    startup = StartupTimer()
+    warmup = CameraWarmup(startup)
+    warmup.start()
+
+    # the child process opens the devices and calibrates
+    with startup.phase('calibration'):
+        s = SonarProcess(LOW_FREQ, HIGH_FREQ, TRANSMIT_FREQ)
+        s.start()
+        calibrated = s.wait_calibrated()
+    if calibrated:
+        warmup.detect_signs(s)
+    else:
+        warmup.release()
+    s.abort()
+    s.join()
+
+
+if __name__ == '__main__':
+    if METRICS_FILE:
+        export_json_lines(METRICS_FILE)
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
+
+    if SONAR_PROCESS:
+        run_process()
+    else:
+        run_threads()
@@ -0,0 +1,179 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import log10
+
+# histogram buckets are log spaced, BUCKETS_PER_DECADE per factor of 10 from HIST_MIN to HIST_MAX
+HIST_MIN = 1e-6
+HIST_MAX = 1e3
+BUCKETS_PER_DECADE = 10
+RATE_WINDOW = 10  # seconds over which counter rates are averaged
+EXPORT_INTERVAL = 10  # default seconds between JSON lines
+
+_EDGES = [HIST_MIN * 10 ** (i / BUCKETS_PER_DECADE)
+          for i in range(int(round(log10(HIST_MAX / HIST_MIN) * BUCKETS_PER_DECADE)) + 1)]
+
+
+class Histogram:
+    ''' fixed log-bucket histogram, constant time and memory per observation '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.buckets = [0] * (len(_EDGES) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def observe(self, value):
+        i = bisect_left(_EDGES, value)
+        with self._lock:
+            self.buckets[i] += 1
+            self.count += 1
+            self.sum += value
+            if value < self.min: self.min = value
+            if value > self.max: self.max = value
+
+    # estimated value at quantile q in [0, 1], accurate to one bucket width
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n > 0:
+                low = _EDGES[i - 1] if i > 0 else self.min
+                high = _EDGES[i] if i < len(_EDGES) else self.max
+                return min(max((low * high) ** 0.5 if low > 0 else high, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.sum / self.count, 'min': self.min, 'max': self.max,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99)}
+
+
+class Counter:
+    ''' monotonically increasing count with a rate over the last RATE_WINDOW seconds '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self._seconds = [None] * RATE_WINDOW  # which second each slot currently holds
+        self._slots = [0] * RATE_WINDOW
+
+    def incr(self, n = 1):
+        sec = int(time.monotonic())
+        i = sec % RATE_WINDOW
+        with self._lock:
+            self.total += n
+            if self._seconds[i] != sec:
+                self._seconds[i] = sec
+                self._slots[i] = 0
+            self._slots[i] += n
+
+    # events per second over the last full RATE_WINDOW seconds
+    def rate(self):
+        now = int(time.monotonic())
+        with self._lock:
+            recent = sum(n for sec, n in zip(self._seconds, self._slots)
+                         if sec is not None and now - RATE_WINDOW <= sec < now)
+        return recent / RATE_WINDOW
+
+
+class Metrics:
+    ''' named histograms, counters and gauges shared by SONAR and the camera loop '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.time()
+
+    def histogram(self, name):
+        hist = self.histograms.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(name, Histogram())
+        return hist
+
+    def counter(self, name):
+        counter = self.counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self.counters.setdefault(name, Counter())
+        return counter
+
+    def observe(self, name, value):
+        self.histogram(name).observe(value)
+
+    def incr(self, name, n = 1):
+        self.counter(name).incr(n)
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    # time a block of code into histogram name, in seconds
+    def timer(self, name):
+        return _Timer(self.histogram(name))
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.started,
+            'counters': {name: {'total': c.total, 'rate': c.rate()} for name, c in list(self.counters.items())},
+            'gauges': dict(self.gauges),
+            'histograms': {name: h.summary() for name, h in list(self.histograms.items())},
+        }
+
+
+class _Timer:
+    def __init__(self, hist):
+        self._hist = hist
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._hist.observe(time.perf_counter() - self._start)
+
+
+METRICS = Metrics()  # process-wide registry used by default
+
+
+# append a snapshot as one JSON line to path every interval seconds, from a daemon thread
+def export_json_lines(path, interval = EXPORT_INTERVAL, metrics = METRICS):
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            with open(path, 'a') as f:
+                f.write(json.dumps(metrics.snapshot()) + '\n')
+
+    threading.Thread(target = run, daemon = True).start()
+    return stop  # set it to stop exporting
+
+
+# serve the current snapshot as JSON on http://host:port/metrics, from a daemon thread
+def serve_metrics(port, host = '127.0.0.1', metrics = METRICS):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            body = json.dumps(metrics.snapshot()).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # keep scrapes out of the console
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server  # call shutdown() to stop serving